@@ -0,0 +1,121 @@
+"""
+Encodings of "at most one" and "exactly one" constraints over Bool variables.
+
+pairwise:   a clause for every pair of variables, O(n^2) clauses and no new variables
+sequential: the sequential counter of Sinz, O(n) clauses and n-1 new variables
+commander:  the commander encoding of Klieber and Kwon - pairwise inside groups of 3, and
+            recursively at most one commander of all the groups, O(n) clauses
+native:     a single pseudo-boolean constraint (AtMost / PbEq) that Z3 handles directly
+"""
+
+import contextlib
+import io
+import random
+import time
+
+from z3 import *
+
+AMO_ENCODINGS = ['pairwise', 'sequential', 'commander', 'native']
+
+
+def pairwise_at_most_one(variables):
+    return [Or(Not(variables[i]), Not(variables[j]))
+            for i in range(len(variables))
+            for j in range(i + 1, len(variables))]
+
+
+def sequential_at_most_one(variables, name):
+    # s_i holds if one of the first i+1 variables holds
+    n = len(variables)
+    if n <= 1:
+        return []
+    s = [Bool('{}_s_{}'.format(name, i)) for i in range(n - 1)]
+    clauses = [Or(Not(variables[0]), s[0])]
+    for i in range(1, n - 1):
+        clauses.append(Or(Not(variables[i]), s[i]))
+        clauses.append(Or(Not(s[i - 1]), s[i]))
+        clauses.append(Or(Not(variables[i]), Not(s[i - 1])))
+    clauses.append(Or(Not(variables[n - 1]), Not(s[n - 2])))
+    return clauses
+
+
+def commander_at_most_one(variables, name, group_size=3):
+    if len(variables) <= group_size + 1:
+        return pairwise_at_most_one(variables)
+    clauses = []
+    commanders = []
+    for g in range(0, len(variables), group_size):
+        group = variables[g:g + group_size]
+        commander = Bool('{}_c_{}'.format(name, g // group_size))
+        commanders.append(commander)
+        clauses += pairwise_at_most_one(group)
+        # a variable of the group holds only if the commander of the group holds
+        clauses += [Or(Not(x), commander) for x in group]
+    return clauses + commander_at_most_one(commanders, name + '_c', group_size)
+
+
+def at_most_one(variables, encoding='pairwise', name='amo'):
+    """
+    Returns the constraints that say that at most one of variables holds.
+    name is the prefix of the new variables of the encoding, and should be unique for every call.
+    """
+    variables = list(variables)
+    if encoding == 'pairwise':
+        return pairwise_at_most_one(variables)
+    elif encoding == 'sequential':
+        return sequential_at_most_one(variables, name)
+    elif encoding == 'commander':
+        return commander_at_most_one(variables, name)
+    elif encoding == 'native':
+        return [AtMost(*variables, 1)] if len(variables) > 1 else []
+    raise ValueError('Unknown at most one encoding {}'.format(encoding))
+
+
+def exactly_one(variables, encoding='pairwise', name='amo'):
+    """
+    Returns the constraints that say that exactly one of variables holds.
+    """
+    variables = list(variables)
+    if encoding == 'native':
+        return [PbEq([(v, 1) for v in variables], 1)]
+    return [Or(variables)] + at_most_one(variables, encoding, name)
+
+
+def benchmark_amo_encodings(name, function, args, encodings=AMO_ENCODINGS, **options):
+    #runs function(*args, amo=encoding, stats=stats, **options) with every encoding, and prints the number
+    #of constraints it added and the time it took
+    for encoding in encodings:
+        stats = {}
+        start_time = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            function(*args, amo=encoding, stats=stats, **options)
+        print("{} with {}: {} constraints, {:.3f}s".format(
+            name, encoding, stats['constraints'], time.perf_counter() - start_time))
+
+
+def random_graph(n, p, seed=0):
+    rng = random.Random(seed)
+    return list(range(n)), [(u, v) for u in range(n) for v in range(u + 1, n) if rng.random() < p]
+
+
+if __name__ == '__main__':
+    # check every encoding by counting the models of exactly one of n variables
+    for encoding in AMO_ENCODINGS:
+        for n in range(1, 9):
+            x = [Bool('x_{}'.format(i)) for i in range(n)]
+            s = Solver()
+            s.add(exactly_one(x, encoding, 'test'))
+            models = 0
+            while s.check() == sat:
+                m = s.model()
+                models += 1
+                s.add(Or([x[i] != m.eval(x[i], model_completion=True) for i in range(n)]))
+            assert models == n, (encoding, n, models)
+        print("{}: ok".format(encoding))
+
+    from hamiltonian_path import get_hamiltonian_path
+    from k_coloring import get_k_coloring
+    V, E = random_graph(60, 0.2)
+    benchmark_amo_encodings("k coloring (60 vertices, k=15)", get_k_coloring, (15, V, E))
+    V, E = random_graph(20, 0.3)
+    benchmark_amo_encodings("hamiltonian path (20 vertices)", get_hamiltonian_path, (V, E))
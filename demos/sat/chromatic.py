@@ -0,0 +1,55 @@
+"""
+Finding the least number of colors with one incremental solver.
+
+The coloring is encoded once, with as many colors as a known coloring (or a bound) needs, and an item
+can have color c only if enabled_c holds. A probe for k colors is a check with the assumptions that the
+colors from k on are disabled, so what the solver learned in one probe is kept for the next ones, and
+every model that uses fewer colors than it had to lowers the next probe.
+"""
+
+import time
+
+from z3 import *
+
+
+def color_activation(variables, name='colors'):
+    #returns (enabled, clauses): enabled[c] is the literal of color c, and the clauses say that only enabled colors are used
+    k = len(variables[0]) if variables else 0
+    enabled = [Bool('{}_enabled_{}'.format(name, c)) for c in range(k)]
+    return enabled, [Or(Not(x[c]), enabled[c]) for x in variables for c in range(k)]
+
+
+def number_of_colors(coloring):
+    return len(set(coloring.values()))
+
+
+def minimize_colors(s, enabled, lower, best, read_coloring, stats=None):
+    """
+    Probes k = colors of the best coloring - 1 on s, down to lower (a lower bound of the number of colors),
+    and returns the coloring with the least colors that it found, with the colors 0 to k - 1.
+    best is a coloring with at most len(enabled) colors, or None to start with all of them,
+    and read_coloring returns the coloring of a model of s.
+    stats is filled with the status ('sat', or 'unknown' if a probe didn't finish), the number of solver
+    calls and (k, status, time) of every probe.
+    """
+    if stats is None:
+        stats = {}
+    stats['probes'] = []
+    stats['status'] = 'sat'
+    k = len(enabled) if best is None else number_of_colors(best) - 1
+    while k >= lower:
+        start_time = time.perf_counter()
+        res = s.check([Not(enabled[c]) for c in range(k, len(enabled))])
+        stats['probes'].append((k, str(res), time.perf_counter() - start_time))
+        if res != sat:
+            if res == unknown or best is None:
+                stats['status'] = str(res)
+            break
+        best = read_coloring(s.model())
+        k = number_of_colors(best) - 1
+    stats['calls'] = len(stats['probes'])
+    if best is None:
+        return None
+    # a model may skip colors, renumber the colors it used to 0, 1, 2, ...
+    renamed = {c: i for i, c in enumerate(sorted(set(best.values())))}
+    return {item: renamed[c] for item, c in best.items()}
@@ -0,0 +1,86 @@
+"""
+Unsat cores over assumption literals, and their minimization.
+
+plain:    whatever the solver returns from unsat_core(), often far from minimal
+z3:       the same, with Z3's core.minimize option, smaller but still not always minimal
+deletion: core.minimize, and then deletion based minimization on the same solver - every literal of the
+          core is dropped in turn, and kept only if the rest is satisfiable. When the rest is unsatisfiable,
+          its own core replaces it (clause-set refinement), so many literals go away in one call.
+          The result is a minimal core - no literal can be dropped
+"""
+
+import contextlib
+import io
+import time
+
+from z3 import *
+
+CORE_MODES = ['plain', 'z3', 'deletion']
+
+
+def set_core_mode(s, mode='plain'):
+    #configures s before the check with assumptions
+    if mode not in CORE_MODES:
+        raise ValueError('Unknown core mode {}'.format(mode))
+    if mode != 'plain':
+        s.set('core.minimize', True)
+
+
+def minimize_core(s, core):
+    """
+    Returns (core, calls): a minimal subset of core (a list of assumption literals that s is UNSAT with),
+    and the number of checks it took.
+    """
+    necessary = []
+    rest = list(core)
+    calls = 0
+    while rest:
+        candidate = rest.pop()
+        calls += 1
+        if s.check(necessary + rest) == unsat:
+            # the new core is a subset of necessary + rest, drop the rest of the literals that are not in it
+            in_core = set(x.get_id() for x in s.unsat_core())
+            rest = [x for x in rest if x.get_id() in in_core]
+        else:
+            # without candidate there is a model (or the solver doesn't know), so it stays
+            necessary.append(candidate)
+    return necessary, calls
+
+
+def get_core(s, mode='plain', stats=None):
+    """
+    Returns the core of s after a check with assumptions returned unsat, minimized by mode.
+    stats is filled with the size of the core, the number of extra solver calls and the time it took.
+    """
+    if stats is None:
+        stats = {}
+    start_time = time.perf_counter()
+    core = list(s.unsat_core())
+    calls = 0
+    if mode == 'deletion':
+        core, calls = minimize_core(s, core)
+    stats['core_size'] = len(core)
+    stats['core_calls'] = calls
+    stats['core_time'] = time.perf_counter() - start_time
+    return core
+
+
+def benchmark_core_modes(name, function, args, modes=CORE_MODES, **options):
+    #runs function(*args, core_mode=mode, stats=stats, **options) with every mode, and prints the core sizes and times
+    for mode in modes:
+        stats = {}
+        start_time = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            function(*args, core_mode=mode, stats=stats, **options)
+        print("{} with {}: core of {}, {} calls, {:.3f}s".format(
+            name, mode, stats.get('core_size'), stats.get('core_calls'), time.perf_counter() - start_time))
+
+
+if __name__ == '__main__':
+    from cardinality import random_graph
+    from k_coloring_core import get_k_coloring, Petersen_V, Petersen_E
+    benchmark_core_modes("Petersen graph, k=2", get_k_coloring, (2, Petersen_V, Petersen_E))
+    V, E = random_graph(40, 0.3)
+    benchmark_core_modes("random graph ({} edges), k=4".format(len(E)), get_k_coloring, (4, V, E))
+    V, E = random_graph(60, 0.1)
+    benchmark_core_modes("random graph ({} edges), k=3".format(len(E)), get_k_coloring, (3, V, E))
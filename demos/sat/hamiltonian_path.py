@@ -2,8 +2,23 @@
 Example of reduction from finding a Hamiltonial path in a graph to SAT
 """
 
+import contextlib
+import io
+import random
+import time
+
 from z3 import *
 
+try:
+    from .cardinality import at_most_one
+except ImportError: # run as a script, not as a part of the demos.sat package
+    from cardinality import at_most_one
+
+# pairs:      for every step, a clause for every pair of non-adjacent nodes, O(n^3) clauses
+# successors: for every step, the node of the step implies one of its neighbors in the next step,
+#             n clauses of the size of the degree, O(n * |E|) literals
+HAMILTONIAN_ENCODINGS = ['pairs', 'successors']
+
 # Petersen graph
 Petersen_V = list(range(10))
 Petersen_E = [
@@ -43,9 +58,14 @@ nopath_E = [
     (0, 3),
 ]
 
-def get_hamiltonian_path(V, E, directed=False):
+def path_transitions(n, cycle=False):
+    #the pairs of consecutive steps, for a cycle also from the last step back to the first
+    return [(i, i + 1) for i in range(n - 1)] + ([(n - 1, 0)] if cycle and n > 1 else [])
+
+
+def encode_hamiltonian_path(V, E, directed=False, amo='pairwise', encoding='successors', cycle=False):
+    #returns (s, variables), where variables[v][i] holds if v is the node of step i
     n = len(V)
-    assert V == list(range(n))
     steps = list(range(n))
 
     variables = [[Bool('v_{}_step_{}'.format(v, i)) for i in steps] for v in V]
@@ -58,10 +78,7 @@ def get_hamiltonian_path(V, E, directed=False):
 
     # every node must appear at most once
     for v in V:
-        for i in range(n):
-            for j in range(i + 1, n):
-                s.add(Or(Not(variables[v][i]),
-                         Not(variables[v][j])))
+        s.add(at_most_one(variables[v], amo, 'v_{}_amo'.format(v)))
 
     # every step has at least one node
     for i in steps:
@@ -69,30 +86,178 @@ def get_hamiltonian_path(V, E, directed=False):
 
     # every step has at most one node
     for i in steps:
-        for v1 in range(n):
-            for v2 in range(v1 + 1, n):
-                s.add(Or(Not(variables[v1][i]),
-                         Not(variables[v2][i])))
+        s.add(at_most_one([variables[v][i] for v in V], amo, 'step_{}_amo'.format(i)))
 
-    EE = set()
-    for v1, v2 in E:
-        EE.add((v1, v2))
-        if not directed:
-            EE.add((v2, v1))
-    # Non-adjacent nodes v1 and v2 cannot be adjacent in the path
-    for v1 in V:
-        for v2 in V:
-            if (v1, v2) not in EE:
-                for i in range(n-1):
-                    s.add(Or(Not(variables[v1][i]),
-                             Not(variables[v2][i+1])))
+    if encoding == 'pairs':
+        EE = set()
+        for v1, v2 in E:
+            EE.add((v1, v2))
+            if not directed:
+                EE.add((v2, v1))
+        # Non-adjacent nodes v1 and v2 cannot be adjacent in the path
+        for v1 in V:
+            for v2 in V:
+                if (v1, v2) not in EE:
+                    for i, j in path_transitions(n, cycle):
+                        s.add(Or(Not(variables[v1][i]),
+                                 Not(variables[v2][j])))
+    elif encoding == 'successors':
+        successors = [[] for v in V]
+        for v1, v2 in E:
+            successors[v1].append(v2)
+            if not directed:
+                successors[v2].append(v1)
+        # the node after v in the path is one of its neighbors
+        for v in V:
+            for i, j in path_transitions(n, cycle):
+                s.add(Or([Not(variables[v][i])] + [variables[u][j] for u in successors[v]]))
+    else:
+        raise ValueError('Unknown Hamiltonian path encoding {}'.format(encoding))
 
     # print("Solver is:")
     # print(s)
     # print()
+    return s, variables
+
+
+def cut_vertex_components(V, neighbors):
+    """
+    For every node v, the number of connected components of the graph without v, for a connected graph.
+    By the low points of a depth first search: a child c of v whose subtree doesn't reach above v is
+    a component of its own, and so is the rest of the graph when v is not the root.
+    """
+    discovered = [None] * len(V)
+    low = [0] * len(V)
+    components = [0] * len(V)
+    order = 0
+    root = V[0]
+    discovered[root] = low[root] = order
+    stack = [(root, iter(neighbors[root]))]
+    while stack:
+        v, children = stack[-1]
+        u = next(children, None)
+        if u is None:
+            stack.pop()
+            if stack:
+                parent = stack[-1][0]
+                low[parent] = min(low[parent], low[v])
+                if low[v] >= discovered[parent]:
+                    components[parent] += 1
+        elif discovered[u] is None:
+            order += 1
+            discovered[u] = low[u] = order
+            stack.append((u, iter(neighbors[u])))
+        else:
+            low[v] = min(low[v], discovered[u])
+    for v in V:
+        if v != root:
+            components[v] += 1
+    return components
+
+
+def presolve_hamiltonian_path(V, E, directed=False, cycle=False):
+    """
+    Linear time checks of the structure of the graph, before the solver. Returns (rule, endpoints, forced):
+    rule is the rule that shows that there is no Hamiltonian path, or None. A path must
+    - be in a connected graph (weakly connected, for a directed graph)
+    and for an undirected graph:
+    - start and end at the nodes of degree 1, so there are at most two of them (endpoints)
+    - not go through a node that splits the graph into three or more components
+    - use both edges of a node of degree 2 that is not an endpoint (forced), so when both endpoints are
+      known, no node has more than two forced edges
+    A cycle (on at least 3 nodes) has no endpoints, so it can't have a node of degree 1, or a node that
+    splits the graph at all, and all the edges of the nodes of degree 2 are forced.
+    """
+    n = len(V)
+    neighbors = [[] for v in V]
+    for v1, v2 in E:
+        if v1 != v2:
+            neighbors[v1].append(v2)
+            neighbors[v2].append(v1)
+    if n <= 1:
+        return None, [], []
+    reached = [False] * n
+    reached[0] = True
+    stack = [0]
+    while stack:
+        for u in neighbors[stack.pop()]:
+            if not reached[u]:
+                reached[u] = True
+                stack.append(u)
+    if not all(reached):
+        return 'disconnected', [], []
+    if directed:
+        return None, [], []
+    neighbors = [sorted(set(neighbors[v])) for v in V]
+    if cycle and n < 3:
+        return None, [], []
+    endpoints = [v for v in V if len(neighbors[v]) == 1]
+    if len(endpoints) > (0 if cycle else 2):
+        return 'degree 1', [], []
+    if any(components >= (2 if cycle else 3) for components in cut_vertex_components(V, neighbors)):
+        return 'cut vertex', [], []
+    forced = [(v, u) for v in V if len(neighbors[v]) == 2 for u in neighbors[v]]
+    if len(endpoints) == 2 or cycle:
+        # every other node is inside the path, so the edges of the endpoints and of the nodes of degree 2 are in it
+        path_edges = set((min(v, u), max(v, u)) for v, u in forced + [(v, neighbors[v][0]) for v in endpoints])
+        degree = [0] * n
+        for v1, v2 in path_edges:
+            degree[v1] += 1
+            degree[v2] += 1
+        if max(degree) > 2:
+            return 'forced edges', [], []
+    return None, endpoints, forced
+
+
+def add_presolve_constraints(s, variables, endpoints, forced, cycle=False):
+    n = len(variables)
+    if cycle:
+        # the cycle can be rotated, so it starts at node 0
+        if n > 0:
+            s.add(variables[0][0])
+    else:
+        # the path can be reversed, so the first endpoint is the first node
+        for v, i in zip(endpoints, [0, n - 1]):
+            s.add(variables[v][i])
+    # a node of degree 2 inside the path (anywhere in a cycle) is between its two neighbors
+    for v, u in forced:
+        for i in (range(n) if cycle else range(1, n - 1)):
+            s.add(Or(Not(variables[v][i]), variables[u][(i - 1) % n], variables[u][(i + 1) % n]))
+
+
+def read_path(m, variables):
+    path = []
+    for i in range(len(variables)):
+        for v in range(len(variables)):
+            if is_true(m[variables[v][i]]):
+                path.append(v)
+                break
+    return path
+
+
+def get_hamiltonian_path(V, E, directed=False, amo='pairwise', encoding='successors', presolve=True, cycle=False,
+                         stats=None):
+    # amo is the at most one encoding (one of cardinality.AMO_ENCODINGS), encoding is the encoding of the edges of the path
+    # (one of HAMILTONIAN_ENCODINGS), and stats is filled with the status and the number of constraints.
+    # With presolve, the structure of the graph may show that there is no path (the rule is in
+    # stats['decided_by']), and otherwise it fixes the endpoints and the forced edges.
+    # With cycle, the last node of the path must also be adjacent to the first one
+    if stats is None:
+        stats = {}
+    n = len(V)
+    assert V == list(range(n))
+    rule, endpoints, forced = presolve_hamiltonian_path(V, E, directed, cycle) if presolve else (None, [], [])
+    if rule is not None:
+        print("Decided by", rule)
+        stats['status'], stats['decided_by'] = 'unsat', rule
+        return None
+    s, variables = encode_hamiltonian_path(V, E, directed, amo, encoding, cycle)
+    add_presolve_constraints(s, variables, endpoints, forced, cycle)
 
     print("Checking SAT")
+    stats['constraints'] = len(s.assertions())
     res = s.check()
+    stats['status'] = str(res)
     if res == unsat:
         print("UNSAT, No Hamiltonian path")
         return None
@@ -102,14 +267,118 @@ def get_hamiltonian_path(V, E, directed=False):
     else:
         assert res == sat
         print("SAT, Found Hamiltonian path")
+        return read_path(s.model(), variables)
+
+
+def encode_path_cost(s, variables, E, weights, directed=False, cycle=False):
+    """
+    Returns the total cost of the path, the sum of step_cost_i, the weight of the edge from the node of
+    step i to the next one. weights[e] is the weight of the edge E[e] (in both directions if not directed).
+    """
+    n = len(variables)
+    # of parallel edges, the path takes the cheapest
+    successors = [dict() for v in range(n)]
+    for (v1, v2), w in zip(E, weights):
+        successors[v1][v2] = min(w, successors[v1].get(v2, w))
+        if not directed:
+            successors[v2][v1] = min(w, successors[v2].get(v1, w))
+    costs = []
+    for i, j in path_transitions(n, cycle):
+        cost = Int('step_cost_{}'.format(i))
+        costs.append(cost)
+        for v in range(n):
+            for u, w in successors[v].items():
+                s.add(Or(Not(variables[v][i]), Not(variables[u][j]), cost == w))
+    return Sum(costs) if costs else IntVal(0)
+
+
+def get_cheapest_hamiltonian_path(V, E, weights, directed=False, amo='pairwise', encoding='successors',
+                                  presolve=True, cycle=False, timeout=None, callback=None, stats=None):
+    """
+    Returns (path, cost) for a Hamiltonian path (or cycle) of the least total weight, or None if there is none.
+    weights[e] is the weight (an int) of the edge E[e]. Any path is found first, and then
+    'cost < cost of the best path' is added to the same solver until it is UNSAT, so every check keeps
+    what the solver learned. callback(path, cost), if given, is called with every better path.
+    After timeout seconds the best path so far is returned. stats is filled with the status, whether the
+    path is optimal, and the number of solver calls.
+    """
+    if stats is None:
+        stats = {}
+    n = len(V)
+    assert V == list(range(n)) and len(weights) == len(E)
+    deadline = None if timeout is None else time.perf_counter() + timeout
+    stats['calls'] = 0
+    stats['optimal'] = False
+    rule, endpoints, forced = presolve_hamiltonian_path(V, E, directed, cycle) if presolve else (None, [], [])
+    if rule is not None:
+        print("Decided by", rule)
+        stats['status'], stats['decided_by'] = 'unsat', rule
+        return None
+    s, variables = encode_hamiltonian_path(V, E, directed, amo, encoding, cycle)
+    add_presolve_constraints(s, variables, endpoints, forced, cycle)
+    cost = encode_path_cost(s, variables, E, weights, directed, cycle) if E else IntVal(0)
+    best = None
+    while True:
+        if deadline is not None:
+            s.set('timeout', max(1, int((deadline - time.perf_counter()) * 1000)))
+        stats['calls'] += 1
+        res = s.check()
+        if res == unknown:
+            print("Unknown, stopping with the best path so far")
+            stats['status'] = 'unknown' if best is None else 'sat'
+            return best
+        if res == unsat:
+            stats['status'] = 'unsat' if best is None else 'sat'
+            stats['optimal'] = best is not None
+            return best
         m = s.model()
-        path = []
-        for i in steps:
-            for v in V:
-                if is_true(m[variables[v][i]]):
-                    path.append(v)
-                    break
-        return path
+        best = read_path(m, variables), m.eval(cost).as_long()
+        print("Found a path of cost", best[1])
+        if callback is not None:
+            callback(*best)
+        s.add(cost < best[1])
+
+
+def planted_path_graph(n, degree, seed=0):
+    #a random graph with a Hamiltonian path along a random order of the nodes, and about degree neighbors for every node
+    rng = random.Random(seed)
+    order = list(range(n))
+    rng.shuffle(order)
+    E = set((min(order[i], order[i + 1]), max(order[i], order[i + 1])) for i in range(n - 1))
+    while len(E) < n * degree // 2:
+        v1, v2 = rng.sample(range(n), 2)
+        E.add((min(v1, v2), max(v1, v2)))
+    return list(range(n)), sorted(E)
+
+
+def is_hamiltonian_path(V, E, path, directed=False):
+    edges = set(E) if directed else set(E) | set((v2, v1) for v1, v2 in E)
+    return sorted(path) == list(V) and all((path[i], path[i + 1]) in edges for i in range(len(path) - 1))
+
+
+def benchmark_encodings(sizes=(50, 100, 200, 300), degree=4, max_pairs=50, max_solve=50):
+    """
+    the number of constraints and the time to build both encodings (pairs only up to max_pairs nodes),
+    and the time to find the path with successors up to max_solve nodes (pairs takes minutes already at 50),
+    on random sparse graphs with a planted Hamiltonian path, with the native at most one encoding
+    """
+    print("\n=== Hamiltonian path encodings ===")
+    for n in sizes:
+        V, E = planted_path_graph(n, degree)
+        for encoding in HAMILTONIAN_ENCODINGS:
+            if encoding == 'pairs' and n > max_pairs:
+                continue
+            start_time = time.perf_counter()
+            s, variables = encode_hamiltonian_path(V, E, amo='native', encoding=encoding)
+            line = "{} nodes, {} edges, {}: {} constraints, built in {:.3f}s".format(
+                n, len(E), encoding, len(s.assertions()), time.perf_counter() - start_time)
+            if encoding == 'successors' and n <= max_solve:
+                start_time = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    path = get_hamiltonian_path(V, E, amo='native', encoding=encoding)
+                assert is_hamiltonian_path(V, E, path)
+                line += ", solved in {:.3f}s".format(time.perf_counter() - start_time)
+            print(line)
 
 
 if __name__ == '__main__':
@@ -127,3 +396,41 @@ if __name__ == '__main__':
     p = get_hamiltonian_path(nopath_V, nopath_E)
     print(p)
     print()
+
+    # both encodings, with and without presolve, agree on small random graphs
+    rng = random.Random(0)
+    rules = dict()
+    for t in range(60):
+        V = list(range(rng.randint(1, 8)))
+        E = [(v1, v2) for v1 in V for v2 in V if v1 != v2 and rng.random() < 0.2]
+        for directed in [False, True]:
+            stats = {}
+            with contextlib.redirect_stdout(io.StringIO()):
+                paths = [get_hamiltonian_path(V, E, directed, encoding=encoding, presolve=False)
+                         for encoding in HAMILTONIAN_ENCODINGS]
+                paths.append(get_hamiltonian_path(V, E, directed, stats=stats))
+            assert all((path is None) == (paths[0] is None) for path in paths)
+            assert all(path is None or is_hamiltonian_path(V, E, path, directed) for path in paths)
+            rules[stats.get('decided_by')] = rules.get(stats.get('decided_by'), 0) + 1
+    print("encodings agree, decided by:", rules)
+
+    print()
+    print("Petersen graph, Hamiltonian cycle:")
+    print(get_hamiltonian_path(Petersen_V, Petersen_E, cycle=True))
+    print()
+
+    # the cheapest path of a random weighted graph, with the improving paths as they are found
+    V, E = planted_path_graph(30, 6)
+    weights = [rng.randint(1, 100) for e in E]
+    start_time = time.perf_counter()
+    improvements = []
+    stats = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        path, cost = get_cheapest_hamiltonian_path(
+            V, E, weights, timeout=20, stats=stats,
+            callback=lambda path, cost: improvements.append((cost, time.perf_counter() - start_time)))
+    assert is_hamiltonian_path(V, E, path)
+    print("Cheapest path of {} nodes: cost {}, optimal: {}, {} calls".format(len(V), cost, stats['optimal'], stats['calls']))
+    print("improvements:", ", ".join("{} after {:.3f}s".format(c, t) for c, t in improvements))
+
+    benchmark_encodings()
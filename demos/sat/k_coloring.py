@@ -2,8 +2,21 @@
 Example of reduction from k-coloring of a graph to SAT
 """
 
+import contextlib
+import io
+import time
+
 from z3 import *
 
+try:
+    from .cardinality import at_most_one
+    from .chromatic import color_activation, minimize_colors, number_of_colors
+    from .symmetry import break_color_symmetry, greedy_clique
+except ImportError: # run as a script, not as a part of the demos.sat package
+    from cardinality import at_most_one
+    from chromatic import color_activation, minimize_colors, number_of_colors
+    from symmetry import break_color_symmetry, greedy_clique
+
 # Petersen graph
 Petersen_V = list(range(10))
 Petersen_E = [
@@ -35,8 +48,8 @@ simple_E = [
     (2, 3),
 ]
 
-def get_k_coloring(k, V, E):
-    assert V == list(range(len(V)))
+def encode_k_coloring(k, V, E, amo='pairwise', symmetry_breaking=False):
+    #returns (s, variables), where variables[v][c] holds if v has color c
     colors = list(range(k))
     variables = [[Bool('v_{}_color_{}'.format(v, c)) for c in colors] for v in V]
 
@@ -48,10 +61,7 @@ def get_k_coloring(k, V, E):
 
     # every node has at most one color
     for v in V:
-        for c1 in range(k):
-            for c2 in range(c1 + 1, k):
-                s.add(Or(Not(variables[v][c1]),
-                         Not(variables[v][c2])))
+        s.add(at_most_one(variables[v], amo, 'v_{}_amo'.format(v)))
 
     # every edge connects nodes with different colors
     for v1, v2 in E:
@@ -59,11 +69,35 @@ def get_k_coloring(k, V, E):
             s.add(Or(Not(variables[v1][c]),
                      Not(variables[v2][c])))
 
+    if symmetry_breaking:
+        s.add(break_color_symmetry(variables, greedy_clique(V, E), 'v_sym'))
+
     # print("Solver is:")
     # print(s)
     # print()
+    return s, variables
+
+
+def read_coloring(m, variables):
+    coloring = dict()
+    for v in range(len(variables)):
+        for c in range(len(variables[v])):
+            if is_true(m[variables[v][c]]):
+                coloring[v] = c
+                break
+    return coloring
+
+
+def get_k_coloring(k, V, E, amo='pairwise', symmetry_breaking=False, stats=None):
+    # amo is the at most one encoding (one of cardinality.AMO_ENCODINGS), stats is filled with the number of constraints.
+    # symmetry_breaking fixes the colors of a clique and adds value precedence (see symmetry.py)
+    if stats is None:
+        stats = {}
+    assert V == list(range(len(V)))
+    s, variables = encode_k_coloring(k, V, E, amo, symmetry_breaking)
 
     print("Checking SAT")
+    stats['constraints'] = len(s.assertions())
     res = s.check()
     if res == unsat:
         print("UNSAT, No K coloring")
@@ -74,14 +108,57 @@ def get_k_coloring(k, V, E):
     else:
         assert res == sat
         print("SAT, Found K coloring")
-        m = s.model()
-        coloring = dict()
-        for v in V:
-            for c in colors:
-                if is_true(m[variables[v][c]]):
-                    coloring[v] = c
-                    break
-        return coloring
+        return read_coloring(s.model(), variables)
+
+
+def greedy_coloring(V, E):
+    #every vertex, by decreasing degree, gets the least color that its colored neighbors don't have
+    neighbors = {v: set() for v in V}
+    for v1, v2 in E:
+        neighbors[v1].add(v2)
+        neighbors[v2].add(v1)
+    coloring = dict()
+    for v in sorted(V, key=lambda u: -len(neighbors[u])):
+        used = set(coloring[u] for u in neighbors[v] if u in coloring)
+        coloring[v] = next(c for c in range(len(V)) if c not in used)
+    return coloring
+
+
+def chromatic_number(V, E, amo='pairwise', symmetry_breaking=False, stats=None):
+    """
+    Returns (k, coloring) with the least number of colors k. The graph is encoded once with the colors
+    of a greedy coloring, and fewer colors are probed by disabling colors (see chromatic.py), down to
+    the size of a clique. stats is filled as in chromatic.minimize_colors.
+    """
+    if stats is None:
+        stats = {}
+    assert V == list(range(len(V)))
+    if not V:
+        return 0, dict()
+    best = greedy_coloring(V, E)
+    s, variables = encode_k_coloring(number_of_colors(best), V, E, amo, symmetry_breaking)
+    enabled, clauses = color_activation(variables, 'v')
+    s.add(clauses)
+    best = minimize_colors(s, enabled, len(greedy_clique(V, E)), best, lambda m: read_coloring(m, variables), stats)
+    print("Chromatic number:", number_of_colors(best))
+    return number_of_colors(best), best
+
+
+def benchmark_chromatic_number(name, V, E, **options):
+    #chromatic_number against a new get_k_coloring for every k from the size of a clique up
+    start_time = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        k = len(greedy_clique(V, E))
+        while get_k_coloring(k, V, E, **options) is None:
+            k += 1
+    rebuild_time = time.perf_counter() - start_time
+    stats = {}
+    start_time = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        chromatic, coloring = chromatic_number(V, E, stats=stats, **options)
+    assert chromatic == k
+    print("{}: chromatic number {}, rebuilding {:.3f}s, incremental {:.3f}s ({} calls)".format(
+        name, k, rebuild_time, time.perf_counter() - start_time, stats['calls']))
 
 
 def draw_graph(V, E, coloring={}, filename='graph', engine='circo', directed=False):
@@ -136,3 +213,16 @@ if __name__ == '__main__':
     print(c)
     draw_graph(Petersen_V, Petersen_E, c, 'Petersen-2')
     print()
+
+    print("Petersen graph:")
+    print(chromatic_number(Petersen_V, Petersen_E))
+    print()
+
+    from cardinality import random_graph
+    from symmetry import mycielski_graph
+    for n in [50, 70]:
+        V, E = random_graph(n, 0.3)
+        benchmark_chromatic_number("random graph ({} vertices, {} edges)".format(n, len(E)), V, E,
+                                   symmetry_breaking=True)
+    V, E = mycielski_graph(5)
+    benchmark_chromatic_number("Mycielski graph 5", V, E, symmetry_breaking=True)
@@ -4,6 +4,11 @@ Example of reduction from k-coloring of a graph to SAT, which uses unsat cores t
 
 from z3 import *
 
+try:
+    from .cores import get_core, set_core_mode
+except ImportError: # run as a script, not as a part of the demos.sat package
+    from cores import get_core, set_core_mode
+
 # Petersen graph
 Petersen_V = list(range(10))
 Petersen_E = [
@@ -35,12 +40,16 @@ simple_E = [
     (2, 3),
 ]
 
-def get_k_coloring(k, V, E):
+def get_k_coloring(k, V, E, core_mode='plain', stats=None):
+    # core_mode is how the core is minimized (one of cores.CORE_MODES), stats is filled with its size, calls and time
+    if stats is None:
+        stats = {}
     assert V == list(range(len(V)))
     colors = list(range(k))
     variables = [[Bool('v_{}_color_{}'.format(v, c)) for c in colors] for v in V]
 
     s = Solver()
+    set_core_mode(s, core_mode)
 
     # every node has at least one color
     for v in V:
@@ -70,7 +79,7 @@ def get_k_coloring(k, V, E):
     res = s.check(edge_variables)
     if res == unsat:
         print("UNSAT, No K coloring")
-        core = s.unsat_core()
+        core = get_core(s, core_mode, stats)
         print("UNSAT core:", core)
         coloring = {}
         for x in core:
@@ -0,0 +1,138 @@
+"""
+Breaking the symmetry of the colors in coloring encodings.
+
+The colors are interchangeable, so every coloring comes with k! - 1 renamed copies, and a proof that
+there is no coloring has to go through all of them. Both constraints here keep one representative
+of every class of renamed colorings:
+clique:           items that must all have different colors (a clique of the graph for vertex coloring,
+                  the edges of a vertex for edge coloring) get the colors 0, 1, 2, ... in order
+value precedence: in a fixed order of the items, an item has color c > 0 only if an earlier item
+                  has color c - 1, so the colors are used for the first time in increasing order
+"""
+
+import contextlib
+import io
+import time
+
+from z3 import *
+
+
+def greedy_clique(V, E):
+    #a maximal clique, built by adding the vertex of max degree among the common neighbors
+    neighbors = {v: set() for v in V}
+    for v1, v2 in E:
+        if v1 != v2:
+            neighbors[v1].add(v2)
+            neighbors[v2].add(v1)
+    clique = []
+    candidates = set(V)
+    while candidates:
+        v = max(candidates, key=lambda u: (len(neighbors[u] & candidates), -u))
+        clique.append(v)
+        candidates &= neighbors[v]
+    return clique
+
+
+def fix_clique_colors(variables, clique):
+    # variables[i][c] holds if item i has color c
+    k = len(variables[0]) if variables else 0
+    return [variables[i][c] for c, i in enumerate(clique[:k])]
+
+
+def value_precedence(variables, order, name='sym'):
+    """
+    Returns the constraints that say that, in order, a color c > 0 appears only after c - 1.
+    used_i_c (a new variable) holds if one of the items up to the i-th in order has color c.
+    """
+    clauses = []
+    k = len(variables[0]) if variables else 0
+    previous = None
+    for i, item in enumerate(order):
+        used = [Bool('{}_used_{}_{}'.format(name, i, c)) for c in range(k)]
+        for c in range(k):
+            earlier = [previous[c]] if previous is not None else []
+            # used_i_c is exactly item has c or used_(i-1)_c
+            clauses.append(Or(Not(variables[item][c]), used[c]))
+            clauses += [Or(Not(u), used[c]) for u in earlier]
+            clauses.append(Or([Not(used[c]), variables[item][c]] + earlier))
+            if c > 0:
+                clauses.append(Or([Not(variables[item][c])] + ([previous[c - 1]] if previous is not None else [])))
+        previous = used
+    return clauses
+
+
+def break_color_symmetry(variables, clique, name='sym'):
+    """
+    Returns the constraints that fix the colors of clique, and value precedence in the order that
+    starts with clique and goes on with the other items by their indices.
+    """
+    in_clique = set(clique)
+    order = list(clique) + [i for i in range(len(variables)) if i not in in_clique]
+    return fix_clique_colors(variables, clique) + value_precedence(variables, order, name)
+
+
+def benchmark_symmetry_breaking(name, function, args, **options):
+    #runs function(*args, symmetry_breaking=..., **options) without and with symmetry breaking, and prints the times
+    times = []
+    results = []
+    for symmetry_breaking in [False, True]:
+        start_time = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            results.append(function(*args, symmetry_breaking=symmetry_breaking, **options))
+        times.append(time.perf_counter() - start_time)
+    assert (results[0] is None) == (results[1] is None)
+    print("{}: {:.3f}s, with symmetry breaking {:.3f}s".format(name, times[0], times[1]))
+
+
+def mycielski_graph(n):
+    #the Mycielski graph with chromatic number n and no triangles
+    V, E = [0, 1], [(0, 1)]
+    for i in range(n - 2):
+        m = len(V)
+        # a shadow m + v of every vertex v, connected to the neighbors of v, and a vertex connected to all shadows
+        E = E + [(m + v1, v2) for v1, v2 in E] + [(v1, m + v2) for v1, v2 in E] + [(m + v, 2 * m) for v in V]
+        V = list(range(2 * m + 1))
+    return V, E
+
+
+def count_colorings(k, V, E, symmetry_breaking):
+    #the number of k-colorings of the graph, with symmetry breaking only one for every renaming of the colors
+    variables = [[Bool('x_{}_{}'.format(v, c)) for c in range(k)] for v in V]
+    s = Solver()
+    for v in V:
+        s.add(PbEq([(x, 1) for x in variables[v]], 1))
+    for v1, v2 in E:
+        s.add([Or(Not(variables[v1][c]), Not(variables[v2][c])) for c in range(k)])
+    if symmetry_breaking:
+        s.add(break_color_symmetry(variables, greedy_clique(V, E)))
+    colorings = set()
+    while s.check() == sat:
+        m = s.model()
+        coloring = tuple(next(c for c in range(k) if is_true(m.eval(variables[v][c]))) for v in V)
+        colorings.add(coloring)
+        s.add(Or([Not(variables[v][coloring[v]]) for v in V]))
+    return colorings
+
+
+if __name__ == '__main__':
+    # check that symmetry breaking keeps exactly one coloring for every renaming of the colors
+    import random
+    rng = random.Random(0)
+    for i in range(20):
+        k = rng.randint(2, 4)
+        V = list(range(rng.randint(1, 7)))
+        E = [(v1, v2) for v1 in V for v2 in V if v1 < v2 and rng.random() < 0.4]
+        partitions = set(frozenset(frozenset(v for v in V if coloring[v] == c) for c in set(coloring))
+                         for coloring in count_colorings(k, V, E, False))
+        assert len(count_colorings(k, V, E, True)) == len(partitions)
+    print("symmetry breaking: ok")
+
+    from k_coloring import get_k_coloring
+    for n in range(3, 6):
+        V, E = mycielski_graph(n)
+        benchmark_symmetry_breaking("Mycielski graph {} ({} vertices), k={} (UNSAT)".format(n, len(V), n - 1),
+                                    get_k_coloring, (n - 1, V, E))
+    for n in range(8, 11):
+        V = list(range(n))
+        E = [(v1, v2) for v1 in V for v2 in V if v1 < v2]
+        benchmark_symmetry_breaking("K{}, k={} (UNSAT)".format(n, n - 1), get_k_coloring, (n - 1, V, E))
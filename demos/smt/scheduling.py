@@ -4,6 +4,11 @@ Example of reduction of "job shop" scheduling to SMT (theory of integers).
 See slides 16-20 here: http://fmv.jku.at/rerise14/rerise14-smt-slides-1.pdf
 """
 
+import contextlib
+import io
+import random
+import time
+
 from z3 import *
 
 jobs0 = [
@@ -19,7 +24,73 @@ jobs1 = [
     [(1, 7), (2, 6)],
 ]
 
-def schedule(jobs, time_limit=None):
+# disjunctive: for every two tasks on the same machine, one finishes before the other starts
+# ordering:    a Bool for every two tasks on the same machine that picks which one is first, and
+#              an implication for each of the two orders
+MACHINE_ENCODINGS = ['disjunctive', 'ordering']
+
+
+def conflicting_tasks_quadratic(jobs):
+    #compares every two tasks of different jobs, kept as the reference for benchmark_conflicts
+    for j1 in range(len(jobs)):
+        for j2 in range(j1+1, len(jobs)):
+            for k1 in range(len(jobs[j1])):
+                for k2 in range(len(jobs[j2])):
+                    if jobs[j1][k1][0] == jobs[j2][k2][0]:
+                        yield (j1, k1), (j2, k2)
+
+
+def conflicting_tasks(jobs):
+    #the pairs of tasks of different jobs on the same machine, found through the tasks of every machine
+    machine_tasks = dict()
+    for j in range(len(jobs)):
+        for k in range(len(jobs[j])):
+            machine_tasks.setdefault(jobs[j][k][0], []).append((j, k))
+    for tasks in machine_tasks.values():
+        for a in range(len(tasks)):
+            for b in range(a + 1, len(tasks)):
+                if tasks[a][0] != tasks[b][0]: # tasks of the same job are ordered by the job
+                    yield tasks[a], tasks[b]
+
+
+def lower_bound(jobs):
+    #no schedule is shorter than the longest job, or than the total time of the tasks of one machine
+    machine_load = dict()
+    for job in jobs:
+        for m, d in job:
+            machine_load[m] = machine_load.get(m, 0) + d
+    return max([sum(d for m, d in job) for job in jobs] + list(machine_load.values()) + [0])
+
+
+def add_machine_constraints(s, jobs, t, machine_encoding='disjunctive'):
+    # two tasks on the same machine must not overlap
+    if machine_encoding not in MACHINE_ENCODINGS:
+        raise ValueError('Unknown machine encoding {}'.format(machine_encoding))
+    # the end times of the tasks are built once, and not again for every pair
+    end = [[t[j][k] + jobs[j][k][1] for k in range(len(jobs[j]))] for j in range(len(jobs))]
+    for (j1, k1), (j2, k2) in conflicting_tasks(jobs):
+        t1 = t[j1][k1]
+        t2 = t[j2][k2]
+        if machine_encoding == 'disjunctive':
+            s.add(Or(t2 >= end[j1][k1],
+                     t1 >= end[j2][k2]))
+        else:
+            first = Bool('first_{}_{}_{}_{}'.format(j1, k1, j2, k2))
+            s.add(Implies(first, t2 >= end[j1][k1]))
+            s.add(Implies(Not(first), t1 >= end[j2][k2]))
+
+
+def schedule(jobs, time_limit=None, strategy='binary', machine_encoding='disjunctive', stats=None):
+    """
+    Returns (t_max, plan) with the least t_max up to time_limit (by default the sum of all the durations,
+    when the tasks run one after the other), or None.
+    All the constraints are added once to one solver, where t_max is a single Int constant, and every probe
+    of a bound on it is a push / pop. strategy is 'binary' (a binary search between the lower bound and
+    time_limit) or 'linear' (from the lower bound up by 1), and machine_encoding is one of MACHINE_ENCODINGS.
+    stats is filled with the number of calls and (bound, status, time) of every probe.
+    """
+    if stats is None:
+        stats = {}
     n_jobs = len(jobs)
 
     print("jobs:")
@@ -33,54 +104,72 @@ def schedule(jobs, time_limit=None):
     print("t = ", t)
     print()
 
-    t_max = max(max(d for m, d in job) for job in jobs)
     if time_limit is None:
         time_limit = sum(sum(d for m, d in job) for job in jobs)
-    m = None
-    while m is None and t_max <= time_limit:
-        print("t_max = ", t_max)
-        print()
 
-        s = Solver()
-
-        # job constrains
-        for j in range(n_jobs):
-            # the first task of job j must start at time >= 0
-            s.add(t[j][0] >= 0)
-            for k in range(1, len(jobs[j])):
-                # the k'th talk of job i must start after the k-1 task finished
-                s.add(t[j][k] >= t[j][k-1] + jobs[j][k-1][1])
-            # the last task of job j must finish by time t_max
-            s.add(t[j][-1] + jobs[j][-1][1] <= t_max)
-
-        # machine constrains
-        for j1 in range(n_jobs):
-            for j2 in range(j1+1, n_jobs):
-                for k1 in range(len(jobs[j1])):
-                    for k2 in range(len(jobs[j2])):
-                        t1 = t[j1][k1]
-                        t2 = t[j2][k2]
-                        m1, d1 = jobs[j1][k1]
-                        m2, d2 = jobs[j2][k2]
-                        if m1 == m2:
-                            # two tasks on the same machine must not overlap
-                            s.add(Or(t2 >= t1 + d1,
-                                     t1 >= t2 + d2))
-
-        print("Solver:")
-        print(s)
-        print()
+    t_max = Int('t_max')
+    s = Solver()
 
+    # job constrains
+    for j in range(n_jobs):
+        # the first task of job j must start at time >= 0
+        s.add(t[j][0] >= 0)
+        for k in range(1, len(jobs[j])):
+            # the k'th talk of job i must start after the k-1 task finished
+            s.add(t[j][k] >= t[j][k-1] + jobs[j][k-1][1])
+        # the last task of job j must finish by time t_max
+        s.add(t[j][-1] + jobs[j][-1][1] <= t_max)
+
+    # machine constrains
+    add_machine_constraints(s, jobs, t, machine_encoding)
+
+    print("Solver:")
+    print(s)
+    print()
+
+    stats['probes'] = []
+
+    def probe(bound):
+        #checks if all the jobs can finish by bound, and returns the model or None
+        print("t_max = ", bound)
+        start_time = time.perf_counter()
+        s.push()
+        s.add(t_max <= bound)
         res = s.check()
-        if res == sat:
-            print("SAT\n")
-            m = s.model()
-        elif res == unknown:
+        model = s.model() if res == sat else None
+        s.pop()
+        stats['probes'].append((bound, str(res), time.perf_counter() - start_time))
+        print("{} in {:.3f}s\n".format(str(res).upper(), stats['probes'][-1][2]))
+        if res == unknown:
             raise Exception('Got unknown from Z3')
-        else:
-            assert res == unsat
-            print("UNSAT, increasing t_max\n")
-            t_max += 1
+        return model
+
+    def makespan(model):
+        return max([model[t[j][-1]].as_long() + jobs[j][-1][1] for j in range(n_jobs)] + [0])
+
+    lo = lower_bound(jobs)
+    m = None
+    if strategy == 'linear':
+        while m is None and lo <= time_limit:
+            m = probe(lo)
+            if m is None:
+                lo += 1
+        hi = lo
+    elif strategy == 'binary':
+        hi = time_limit
+        m = probe(hi) if lo <= hi else None
+        if m is not None:
+            hi = makespan(m)
+            while lo < hi:
+                mid = (lo + hi) // 2
+                model = probe(mid)
+                if model is None:
+                    lo = mid + 1
+                else:
+                    m, hi = model, makespan(model)
+    else:
+        raise ValueError('Unknown search strategy {}'.format(strategy))
+    stats['calls'] = len(stats['probes'])
 
     if m is None:
         print("Time limit reached")
@@ -91,10 +180,10 @@ def schedule(jobs, time_limit=None):
                  for k in range(len(jobs[j]))]
                 for j in range(n_jobs)]
 
-        print("t_max = ", t_max)
+        print("t_max = ", hi)
         print("plan = ", plan)
         print()
-        return t_max, plan
+        return hi, plan
 
 def old_print_plan(jobs, plan):
     print("jobs:")
@@ -152,6 +241,57 @@ def print_plan(jobs, plan):
     print()
 
 
+def random_jobs(n_jobs, n_machines, max_duration=10, seed=0, tasks_per_job=None):
+    #every job has a task on every machine (or on tasks_per_job random machines), in a random order
+    rng = random.Random(seed)
+    jobs = []
+    for j in range(n_jobs):
+        machines = list(range(1, n_machines + 1))
+        rng.shuffle(machines)
+        jobs.append([(m, rng.randint(1, max_duration)) for m in machines[:tasks_per_job]])
+    return jobs
+
+
+def benchmark_search(sizes=((4, 4), (6, 6), (8, 8), (10, 10)), strategies=('linear', 'binary')):
+    print("\n=== Makespan search ===")
+    for n_jobs, n_machines in sizes:
+        jobs = random_jobs(n_jobs, n_machines)
+        for strategy in strategies:
+            stats = {}
+            start_time = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                t_max, plan = schedule(jobs, strategy=strategy, stats=stats)
+            print("{} jobs x {} machines, {}: t_max {}, {} calls, {:.3f}s".format(
+                n_jobs, n_machines, strategy, t_max, stats['calls'], time.perf_counter() - start_time))
+            print("    probes: " + ", ".join("{} {} {:.3f}s".format(bound, status, probe_time)
+                                           for bound, status, probe_time in stats['probes']))
+
+
+def benchmark_conflicts(instances=((100, 20, None), (400, 200, 5)), seed=0):
+    """
+    time of finding the pairs of tasks on the same machine, for the comparison of all task pairs and
+    through the tasks of every machine, and the time of adding the machine constraints of every encoding.
+    instances are (jobs, machines, tasks per job): when every job has a task on every machine, all the pairs
+    of tasks of different jobs on a machine are conflicts anyway, and when the jobs use a few of many machines
+    most pairs are on different machines, and only the grouping by machine skips them
+    """
+    print("\n=== Machine constraints ===")
+    for n_jobs, n_machines, tasks_per_job in instances:
+        jobs = random_jobs(n_jobs, n_machines, seed=seed, tasks_per_job=tasks_per_job)
+        name = "{} jobs x {} tasks on {} machines".format(n_jobs, len(jobs[0]), n_machines)
+        pair_sets = []
+        for pairs_of in [conflicting_tasks_quadratic, conflicting_tasks]:
+            start_time = time.perf_counter()
+            pair_sets.append(set(frozenset(pair) for pair in pairs_of(jobs)))
+            print("{}, {}: {} pairs in {:.3f}s".format(
+                name, pairs_of.__name__, len(pair_sets[-1]), time.perf_counter() - start_time))
+        assert pair_sets[0] == pair_sets[1]
+        t = [[Int('t_{}_{}'.format(j, k)) for k in range(len(jobs[j]))] for j in range(len(jobs))]
+        for machine_encoding in MACHINE_ENCODINGS:
+            start_time = time.perf_counter()
+            add_machine_constraints(Solver(), jobs, t, machine_encoding)
+            print("{}, {}: constraints in {:.3f}s".format(name, machine_encoding, time.perf_counter() - start_time))
+
 if __name__ == '__main__':
     print("Example 0\n" + "=" * 80 + "\n")
     t0, p0 = schedule(jobs0)
@@ -162,3 +302,6 @@ if __name__ == '__main__':
     t1, p1 = schedule(jobs1)
     print_plan(jobs1, p1)
     print()
+
+    benchmark_search()
+    benchmark_conflicts()
@@ -2,8 +2,33 @@
 k-edge-coloring exercise.
 """
 
+import concurrent.futures
+import contextlib
+import heapq
+import io
+import itertools
+import multiprocessing
+import os
+import random
+import sys
+import time
+
 from z3 import *
 
+try:
+    from .portfolio import run_portfolio
+except ImportError: # run as a script, not as a part of the ex2 package
+    from portfolio import run_portfolio
+    # the encodings are shared with demos/sat, and are imported from the root of the repository by their
+    # package names, so the root goes at the end of the path and nothing there shadows other modules
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from demos.sat.cardinality import at_most_one, benchmark_amo_encodings, random_graph
+from demos.sat.chromatic import color_activation, minimize_colors, number_of_colors
+from demos.sat.cores import benchmark_core_modes, get_core, set_core_mode
+from demos.sat.symmetry import benchmark_symmetry_breaking, break_color_symmetry
+
+
 Petersen_V = list(range(10))
 Petersen_E = [
     (0 , 1),
@@ -32,14 +57,305 @@ small_E = [
 ]
 
 
-def get_k_edge_coloring(k, V, E):
-    assert V == list(range(len(V)))
-    #initializing
+def adjacent_edge_pairs_quadratic(E):
+    #compares every two edges, kept as the reference for benchmark_adjacency
+    for i in range(len(E)):
+        for j in range(i + 1, len(E)):
+            if len(set(E[i]) & set(E[j])) == 1:
+                yield i, j
+
+
+def incident_edges(E):
+    #vertex -> the indices of the edges that touch it, in increasing order
+    incidence = dict()
+    for e, (v1, v2) in enumerate(E):
+        incidence.setdefault(v1, []).append(e)
+        if v2 != v1:
+            incidence.setdefault(v2, []).append(e)
+    return incidence
+
+
+def adjacent_edge_pairs(E):
+    #the pairs i < j of edges with exactly one common vertex, found through the edges of every vertex,
+    #so only edges that really touch are compared
+    ends = [(min(e), max(e)) for e in E]
+    for edges in incident_edges(E).values():
+        for a in range(len(edges)):
+            i = edges[a]
+            for j in edges[a + 1:]:
+                if ends[i] == ends[j] and ends[i][0] != ends[i][1]:
+                    continue # parallel edges share both vertices
+                yield i, j
+
+
+def edges_of_max_degree_vertex(E):
+    #the edges of a vertex of max degree, that must all have different colors (one of every parallel edges)
+    incidence = incident_edges(E)
+    if not incidence:
+        return []
+    center = max(incidence, key=lambda v: len(incidence[v]))
+    edges = dict()
+    for e in incidence[center]:
+        edges.setdefault(frozenset(E[e]), e)
+    return list(edges.values())
+
+
+def connected_components(E):
+    #the edge indices of every connected component of the graph, by union-find on the vertices
+    parent = dict()
+
+    def find(v):
+        while parent.setdefault(v, v) != v:
+            parent[v] = parent[parent[v]]
+            v = parent[v]
+        return v
+
+    for v1, v2 in E:
+        parent[find(v1)] = find(v2)
+    components = dict()
+    for i, (v1, v2) in enumerate(E):
+        components.setdefault(find(v1), []).append(i)
+    return list(components.values())
+
+
+def solve_component(function, k, V, E, options, quiet=False):
+    #solves one component of solve_components, quiet in a worker process (the outputs of the workers would mix)
+    stats = dict()
+    with contextlib.redirect_stdout(io.StringIO()) if quiet else contextlib.nullcontext():
+        result = function(k, V, E, decompose=False, stats=stats, **options)
+    return result, stats
+
+
+def solve_components(function, k, V, E, components, workers, stats, **options):
+    """
+    Runs function (get_k_edge_coloring or get_k_edge_coloring_core) on the edges of every component,
+    all of them with the same V, and merges the colorings. If a component has no coloring, returns
+    what function returned for it (None, or the core of the first such component).
+    With workers, the components are solved by a pool of that many processes.
+    """
+    subgraphs = [[E[i] for i in component] for component in components]
+    if workers is None:
+        results = (solve_component(function, k, V, sub_E, options) for sub_E in subgraphs)
+        pool = None
+    else:
+        pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers,
+                                                      mp_context=multiprocessing.get_context('spawn'))
+        futures = [pool.submit(solve_component, function, k, V, sub_E, options, True) for sub_E in subgraphs]
+        results = (future.result() for future in futures)
+    stats['components'] = len(components)
+    stats['constraints'] = 0
+    coloring = dict()
+    try:
+        for result, component_stats in results:
+            stats['constraints'] += component_stats.get('constraints', 0)
+            if component_stats['status'] != 'sat':
+                # the status, and the stats of the core if there is one, are of this component
+                stats.update((key, value) for key, value in component_stats.items() if key != 'constraints')
+                return result
+            coloring.update(result)
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+    stats['status'] = 'sat'
+    return coloring
+
+
+def is_simple(E):
+    #no loops and no parallel edges
+    ends = set((min(e), max(e)) for e in E)
+    return len(ends) == len(E) and all(v1 != v2 for v1, v2 in E)
+
+
+def max_degree(E):
+    return max((len(edges) for edges in incident_edges(E).values()), default=0)
+
+
+def is_bipartite(E):
+    side = dict()
+    neighbors = dict()
+    for v1, v2 in E:
+        neighbors.setdefault(v1, []).append(v2)
+        neighbors.setdefault(v2, []).append(v1)
+    for root in neighbors:
+        if root in side:
+            continue
+        side[root] = 0
+        stack = [root]
+        while stack:
+            v = stack.pop()
+            for u in neighbors[v]:
+                if u not in side:
+                    side[u] = 1 - side[v]
+                    stack.append(u)
+                elif side[u] == side[v]:
+                    return False
+    return True
+
+
+class PartialEdgeColoring:
+    #the colors at every vertex of a simple graph: at[v][c] is the neighbor of v through the edge with color c
+    def __init__(self):
+        self.at = dict()
+
+    def free(self, v, c):
+        return c not in self.at.get(v, {})
+
+    def first_free(self, v):
+        c = 0
+        while not self.free(v, c):
+            c += 1
+        return c
+
+    def color(self, v1, v2):
+        for c, u in self.at.get(v1, {}).items():
+            if u == v2:
+                return c
+        return None
+
+    def set(self, v1, v2, c):
+        self.at.setdefault(v1, {})[c] = v2
+        self.at.setdefault(v2, {})[c] = v1
+
+    def unset(self, v1, v2):
+        c = self.color(v1, v2)
+        if c is not None:
+            del self.at[v1][c]
+            del self.at[v2][c]
+
+    def swap_path(self, v, c1, c2):
+        #swaps c1 and c2 along the path that starts at v with the edge of color c1, and alternates c1, c2
+        path = []
+        c = c1
+        while not self.free(v, c):
+            u = self.at[v][c]
+            path.append((v, u, c))
+            v = u
+            c = c2 if c == c1 else c1
+        for v1, v2, c in path:
+            self.unset(v1, v2)
+        for v1, v2, c in path:
+            self.set(v1, v2, c2 if c == c1 else c1)
+
+    def as_coloring(self, E):
+        return {e: self.color(*e) for e in E}
+
+
+def misra_gries_edge_coloring(E):
+    #a coloring of a simple graph with max degree + 1 colors (Vizing), by the algorithm of Misra and Gries
+    colors = PartialEdgeColoring()
+    for u, v in E:
+        # a maximal fan of u that starts with the uncolored edge (u, v)
+        fan = [v]
+        in_fan = {v}
+        extended = True
+        while extended:
+            extended = False
+            for c, w in colors.at.get(u, {}).items():
+                if w not in in_fan and colors.free(fan[-1], c):
+                    fan.append(w)
+                    in_fan.add(w)
+                    extended = True
+                    break
+        c = colors.first_free(u)
+        d = colors.first_free(fan[-1])
+        colors.swap_path(u, d, c)
+        # the first vertex of the fan where d is free, such that the fan up to it is still a fan
+        w = 0
+        while not colors.free(fan[w], d):
+            w += 1
+            assert colors.free(fan[w - 1], colors.color(u, fan[w]))
+        # rotate the fan up to w, and color the last edge with d
+        shifted = [colors.color(u, fan[i + 1]) for i in range(w)]
+        for i in range(1, w + 1):
+            colors.unset(u, fan[i])
+        for i in range(w):
+            colors.set(u, fan[i], shifted[i])
+        colors.set(u, fan[w], d)
+    return colors.as_coloring(E)
+
+
+def bipartite_edge_coloring(E):
+    #a coloring of a simple bipartite graph with max degree colors (Konig), by swapping alternating paths
+    colors = PartialEdgeColoring()
+    for u, v in E:
+        a = colors.first_free(u)
+        b = colors.first_free(v)
+        if not colors.free(v, a):
+            # in a bipartite graph the path of a, b from v doesn't reach u, so after the swap a is free at both
+            colors.swap_path(v, a, b)
+        colors.set(u, v, a)
+    return colors.as_coloring(E)
+
+
+def dsatur_edge_coloring(E):
+    """
+    A greedy coloring of the line graph by DSatur: the next edge to color is the one whose adjacent edges
+    have the most different colors (ties by the most adjacent edges), and it gets the least free color.
+    """
+    adjacent = [[] for e in E]
+    for i, j in adjacent_edge_pairs(E):
+        adjacent[i].append(j)
+        adjacent[j].append(i)
+    colors = [None] * len(E)
+    neighbor_colors = [set() for e in E]
+    heap = [(0, -len(adjacent[e]), e) for e in range(len(E))]
+    heapq.heapify(heap)
+    while heap:
+        saturation, degree, e = heapq.heappop(heap)
+        if colors[e] is not None or -saturation != len(neighbor_colors[e]):
+            continue # an old entry of the edge
+        c = 0
+        while c in neighbor_colors[e]:
+            c += 1
+        colors[e] = c
+        for j in adjacent[e]:
+            if colors[j] is None and c not in neighbor_colors[j]:
+                neighbor_colors[j].add(c)
+                heapq.heappush(heap, (-len(neighbor_colors[j]), -len(adjacent[j]), j))
+    return {E[e]: colors[e] for e in range(len(E))}
+
+
+def presolve_k_edge_coloring(k, E):
+    """
+    Decides k-edge-coloring of a simple graph without a solver when graph theory can:
+    k < max degree is UNSAT, and the edges of a max degree vertex are a core;
+    k >= max degree + 1 is SAT by Vizing's theorem (a Misra-Gries coloring);
+    k >= max degree on a bipartite graph is SAT by Konig's theorem.
+    Returns (status, result, rule) where result is a coloring for 'sat' and a list of edges for 'unsat'.
+    Returns (None, None, None) when it is the hard case (k == max degree on a graph that is not bipartite),
+    or when the graph has loops or parallel edges.
+    """
+    if not is_simple(E):
+        return None, None, None
+    if not E:
+        return 'sat', dict(), 'no edges'
+    incidence = incident_edges(E)
+    center = max(incidence, key=lambda v: len(incidence[v]))
+    delta = len(incidence[center])
+    if k < delta:
+        return 'unsat', [E[e] for e in incidence[center][:k + 1]], 'max degree'
+    if k >= delta + 1:
+        return 'sat', misra_gries_edge_coloring(E), 'vizing'
+    if is_bipartite(E):
+        return 'sat', bipartite_edge_coloring(E), 'konig'
+    return None, None, None
+
+
+def is_k_edge_coloring(k, E, coloring):
+    #every edge has a color below k, and edges with exactly one common vertex have different colors
+    if any(not (0 <= coloring.get(e, -1) < k) for e in E):
+        return False
+    return all(coloring[E[i]] != coloring[E[j]] for i, j in adjacent_edge_pairs(E))
+
+
+def encode_k_edge_coloring(k, E, logic=None, amo='pairwise', symmetry_breaking=False, guards=None):
+    #returns (s, variables), where variables[e][c] holds if the edge E[e] has color c.
+    #with guards (a literal for every edge), the clauses of adjacent edges hold only if the guards of both hold
     edge_indices = range(len(E))
     colors = list(range(k))
     variables = [[Bool('e_{}_color_{}'.format(e, c)) for c in colors] for e in edge_indices]
 
-    s = Solver()
+    s = SolverFor(logic) if logic else Solver()
 
     # every edge has a color
     for e in edge_indices:
@@ -47,28 +363,82 @@ def get_k_edge_coloring(k, V, E):
 
     # every node has at most one color
     for e in edge_indices:
-        for c1 in range(k):
-            for c2 in range(c1 + 1, k):
-                s.add(Or(
-                    Not(variables[e][c1]),
-                    Not(variables[e][c2])
-                ))
+        s.add(at_most_one(variables[e], amo, 'e_{}_amo'.format(e)))
 
     # making sure that adjacent edges have different colors
-    for i in edge_indices:
-        for j in edge_indices[i+1:len(E)]:
-            intersctn = set(E[i]) & set(E[j])
-            if len(intersctn) == 1:
-                for c in colors:
-                    s.add(Or(
-                            Not(variables[i][c]),
-                            Not(variables[j][c])
-                    ))
-                
+    for i, j in adjacent_edge_pairs(E):
+        guarded = [Not(guards[i]), Not(guards[j])] if guards is not None else []
+        for c in colors:
+            s.add(Or(guarded + [
+                    Not(variables[i][c]),
+                    Not(variables[j][c])
+            ]))
+
+    if symmetry_breaking:
+        s.add(break_color_symmetry(variables, edges_of_max_degree_vertex(E), 'e_sym'))
+    return s, variables
+
+
+def presolve_edge_coloring(k, E, stats):
+    #returns (status, result) of presolve_k_edge_coloring, and fills stats when it decides
+    status, result, rule = presolve_k_edge_coloring(k, E)
+    if status is not None:
+        print("Decided by", rule)
+        stats['status'], stats['decided_by'] = status, rule
+    return status, result
+
 
+def read_edge_coloring(m, E, variables):
+    coloring = dict()
+    for e in range(len(E)):
+        # find the right color
+        for c in range(len(variables[e])):
+            if is_true(m[variables[e][c]]):
+                coloring[E[e]] = c
+                break
+    return coloring
+
+
+def get_k_edge_coloring(k, V, E, logic=None, amo='pairwise', presolve=True, decompose=True, workers=None,
+                        symmetry_breaking=False, heuristic=True, stats=None):
+    # logic picks the solver (e.g. 'QF_FD'), amo is the at most one encoding (one of cardinality.AMO_ENCODINGS),
+    # and stats is filled with the status of the check and the number of constraints.
+    # With presolve, the cases that graph theory decides don't reach the solver.
+    # With decompose, every connected component is solved on its own (by a pool of workers processes,
+    # if workers is given). symmetry_breaking fixes the colors of the edges of a vertex of max degree,
+    # and adds value precedence (see demos/sat/symmetry.py).
+    # With heuristic, a DSatur coloring with at most k colors is returned without the solver,
+    # and otherwise its colors below k are the initial values of the solver (stats['heuristic'] tells which)
+    if stats is None:
+        stats = {}
+    assert V == list(range(len(V)))
+    if presolve:
+        status, result = presolve_edge_coloring(k, E, stats)
+        if status is not None:
+            return result if status == 'sat' else None
+    if decompose:
+        components = connected_components(E)
+        if len(components) > 1:
+            return solve_components(get_k_edge_coloring, k, V, E, components, workers, stats,
+                                    logic=logic, amo=amo, presolve=presolve, symmetry_breaking=symmetry_breaking,
+                                    heuristic=heuristic)
+    if heuristic:
+        hint = dsatur_edge_coloring(E)
+        if is_k_edge_coloring(k, E, hint):
+            print("Decided by dsatur")
+            stats['status'], stats['decided_by'], stats['heuristic'] = 'sat', 'dsatur', 'coloring'
+            return hint
+        stats['heuristic'] = 'hint'
+    s, variables = encode_k_edge_coloring(k, E, logic, amo, symmetry_breaking)
+    if heuristic and hasattr(s, 'set_initial_value') and not symmetry_breaking:
+        for e in range(len(E)):
+            if hint[E[e]] < k:
+                s.set_initial_value(variables[e][hint[E[e]]], True)
 
     print("Checking SAT")
+    stats['constraints'] = len(s.assertions())
     res = s.check()
+    stats['status'] = str(res)
     if res == unsat:
         print("UNSAT, No K coloring")
         return None
@@ -78,59 +448,41 @@ def get_k_edge_coloring(k, V, E):
     else:
         assert res == sat
         print("SAT, Found K coloring")
-        m = s.model()
-        coloring = dict()
-        for e in edge_indices:
-            # find the right color
-            for c in colors:
-                if is_true(m[variables[e][c]]):
-                    coloring[E[e]] = c
-                    break
-        return coloring
+        return read_edge_coloring(s.model(), E, variables)
 
 
-def get_k_edge_coloring_core(k, V, E):
+def get_k_edge_coloring_core(k, V, E, logic=None, amo='pairwise', presolve=True, decompose=True, workers=None,
+                             symmetry_breaking=False, core_mode='plain', stats=None):
+    # the same as get_k_edge_coloring, but when there is no coloring it returns an UNSAT core -
+    # the edges of the core of the first component that has no coloring, all with color 1.
+    # core_mode is how the core is minimized (one of cores.CORE_MODES), and stats is filled with its size,
+    # the solver calls and the time of the minimization
+    if stats is None:
+        stats = {}
     assert V == list(range(len(V)))
-    edge_indices = range(len(E))
-    colors = list(range(k))
-    variables = [[Bool('e_{}_color_{}'.format(e, c)) for c in colors] for e in edge_indices]
-
-    s = Solver()
-
-    # every edge has a color
-    for e in edge_indices:
-        s.add(Or([variables[e][c] for c in colors]))
-
-    # every node has at most one color
-    for e in edge_indices:
-        for c1 in range(k):
-            for c2 in range(c1 + 1, k):
-                s.add(Or(
-                    Not(variables[e][c1]),
-                    Not(variables[e][c2])
-                ))
-
-    # making sure that adjacent edges have different colors
-    edge_existence_vars = [Bool(str(i)) for i in edge_indices]
-    for i in edge_indices:
-        for j in edge_indices[i+1:len(E)]:
-            intersctn = set(E[i]) & set(E[j])
-            if len(intersctn) == 1:
-                for c in colors:
-                    s.add(Or(
-                            Not(edge_existence_vars[i]),
-                            Not(edge_existence_vars[j]),
-                            Not(variables[i][c]),
-                            Not(variables[j][c])
-                    ))
-                
-
+    if presolve:
+        status, result = presolve_edge_coloring(k, E, stats)
+        if status is not None:
+            if status == 'unsat':
+                stats['core_size'], stats['core_calls'], stats['core_time'] = len(result), 0, 0
+            return result if status == 'sat' else {e: 1 for e in result}
+    if decompose:
+        components = connected_components(E)
+        if len(components) > 1:
+            return solve_components(get_k_edge_coloring_core, k, V, E, components, workers, stats,
+                                    logic=logic, amo=amo, presolve=presolve, symmetry_breaking=symmetry_breaking,
+                                    core_mode=core_mode)
+    edge_existence_vars = [Bool(str(i)) for i in range(len(E))]
+    s, variables = encode_k_edge_coloring(k, E, logic, amo, symmetry_breaking, guards=edge_existence_vars)
+    set_core_mode(s, core_mode)
 
     print("Checking SAT")
+    stats['constraints'] = len(s.assertions())
     res = s.check(edge_existence_vars)
+    stats['status'] = str(res)
     if res == unsat:
         print("UNSAT, No K coloring")
-        core = s.unsat_core()
+        core = get_core(s, core_mode, stats)
         print("UNSAT core:", core)
         coloring = dict()
         for x in core:
@@ -143,15 +495,204 @@ def get_k_edge_coloring_core(k, V, E):
     else:
         assert res == sat
         print("SAT, Found K coloring")
-        m = s.model()
-        coloring = dict()
-        for e in edge_indices:
-            for c in colors:
-                if is_true(m[variables[e][c]]):
-                    coloring[E[e]] = c
-                    break
-        return coloring
+        return read_edge_coloring(s.model(), E, variables)
+
 
+def enumerate_k_edge_colorings(k, V, E, logic=None, amo='pairwise', modulo_permutations=False, limit=None,
+                               timeout=None, stats=None):
+    """
+    A generator of the k-edge-colorings of the graph, one at a time: after every coloring, a clause that
+    blocks it is added to the same solver. With modulo_permutations, there is one coloring for every
+    renaming of the colors - the symmetry breaking of get_k_edge_coloring keeps exactly one of them.
+    It stops after limit colorings, or after timeout seconds. stats is filled with the count, and
+    'complete' - whether all the colorings were found.
+    The colorings are not kept, but every blocking clause stays in the solver.
+    """
+    if stats is None:
+        stats = {}
+    assert V == list(range(len(V)))
+    deadline = None if timeout is None else time.perf_counter() + timeout
+    s, variables = encode_k_edge_coloring(k, E, logic, amo, symmetry_breaking=modulo_permutations)
+    stats['count'] = 0
+    stats['complete'] = False
+    while limit is None or stats['count'] < limit:
+        if deadline is not None:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                return
+            s.set('timeout', max(1, int(remaining * 1000)))
+        res = s.check()
+        stats['status'] = str(res)
+        if res == unsat:
+            stats['complete'] = True
+            return
+        elif res == unknown:
+            return
+        coloring = read_edge_coloring(s.model(), E, variables)
+        # every edge has exactly one color, so this blocks exactly this coloring
+        s.add(Or([Not(variables[e][coloring[E[e]]]) for e in range(len(E))]))
+        stats['count'] += 1
+        yield coloring
+
+
+def chromatic_index(V, E, logic=None, amo='pairwise', presolve=True, symmetry_breaking=False, stats=None):
+    """
+    Returns (k, coloring) with the least number of colors k. With presolve, a simple bipartite graph
+    needs max degree colors (Konig), and the other simple graphs start from a Misra-Gries coloring with
+    max degree + 1 colors, so only max degree is left to probe. The graph is encoded once with the colors
+    of the best coloring known (or 2 * max degree - 1, that a greedy coloring never exceeds), and fewer
+    colors are probed by disabling colors (see demos/sat/chromatic.py). stats is filled as in
+    chromatic.minimize_colors.
+    """
+    if stats is None:
+        stats = {}
+    assert V == list(range(len(V)))
+    if not E:
+        return 0, dict()
+    best = None
+    if presolve and is_simple(E):
+        if is_bipartite(E):
+            print("Decided by konig")
+            stats['status'], stats['decided_by'], stats['calls'] = 'sat', 'konig', 0
+            coloring = bipartite_edge_coloring(E)
+            return number_of_colors(coloring), coloring
+        best = misra_gries_edge_coloring(E)
+    k = number_of_colors(best) if best is not None else 2 * max_degree(E) - 1
+    s, variables = encode_k_edge_coloring(k, E, logic, amo, symmetry_breaking)
+    enabled, clauses = color_activation(variables, 'e')
+    s.add(clauses)
+    best = minimize_colors(s, enabled, len(edges_of_max_degree_vertex(E)), best,
+                           lambda m: read_edge_coloring(m, E, variables), stats)
+    print("Chromatic index:", number_of_colors(best))
+    return number_of_colors(best), best
+
+class EdgeColoringSession:
+    """
+    A k-edge-coloring of a graph that changes by a few edges at a time, on one live solver.
+    Every edge that was ever added keeps its color variables, and its adjacency clauses are guarded by
+    its activation literal, so removing an edge only drops its literal from the assumptions of the next
+    check, and adding it again reuses them.
+    The last coloring is kept: removing an edge keeps it valid, and so does adding an edge that has a
+    color free at both ends, so these updates don't call the solver at all. Otherwise the next check
+    calls the solver, with the free color as the initial value of the new edge when Z3 supports it.
+    """
+
+    def __init__(self, k, E=(), logic=None, amo='pairwise'):
+        self.k = k
+        self.amo = amo
+        self.s = SolverFor(logic) if logic else Solver()
+        self.edges = [] # every edge that was ever added, by index
+        self.variables = []
+        self.existence = []
+        self.active = set()
+        self.copies = dict() # (min, max) of the ends of an edge -> indices of its active copies
+        self.inactive = dict() # (min, max) of the ends of an edge -> indices of its removed copies
+        self.incidence = dict()
+        self.coloring = dict() # edge index -> color, valid for the active edges when not stale
+        self.stale = False
+        self.calls = 0
+        self.fast_updates = 0
+        for v1, v2 in E:
+            self.add_edge(v1, v2)
+
+    def new_edge(self, v1, v2):
+        i = len(self.edges)
+        self.edges.append((v1, v2))
+        self.variables.append([Bool('e_{}_color_{}'.format(i, c)) for c in range(self.k)])
+        self.existence.append(Bool(str(i)))
+        self.s.add(Or(self.variables[i]))
+        self.s.add(at_most_one(self.variables[i], self.amo, 'e_{}_amo'.format(i)))
+        ends = (min(v1, v2), max(v1, v2))
+        for j in set(self.incidence.get(v1, []) + self.incidence.get(v2, [])):
+            other = self.edges[j]
+            if (min(other), max(other)) == ends and ends[0] != ends[1]:
+                continue # parallel edges share both vertices
+            for c in range(self.k):
+                self.s.add(Or(Not(self.existence[i]), Not(self.existence[j]),
+                              Not(self.variables[i][c]), Not(self.variables[j][c])))
+        self.incidence.setdefault(v1, []).append(i)
+        if v2 != v1:
+            self.incidence.setdefault(v2, []).append(i)
+        return i
+
+    def free_color(self, v1, v2):
+        #a color that no active edge at v1 or v2 has in the last coloring, or None
+        ends = (min(v1, v2), max(v1, v2))
+        used = set(self.coloring[j] for v in (v1, v2) for j in self.incidence.get(v, [])
+                   if j in self.coloring and not ((min(self.edges[j]), max(self.edges[j])) == ends and ends[0] != ends[1]))
+        return next((c for c in range(self.k) if c not in used), None)
+
+    def add_edge(self, v1, v2):
+        ends = (min(v1, v2), max(v1, v2)) # the edge in either orientation
+        if self.inactive.get(ends):
+            i = self.inactive[ends].pop()
+            self.edges[i] = (v1, v2) # the coloring is reported in the orientation of the last add
+        else:
+            i = self.new_edge(v1, v2)
+        c = None if self.stale else self.free_color(v1, v2)
+        self.active.add(i)
+        self.copies.setdefault(ends, []).append(i)
+        if c is None:
+            self.stale = True
+        else:
+            self.coloring[i] = c
+            self.fast_updates += 1
+
+    def remove_edge(self, v1, v2):
+        ends = (min(v1, v2), max(v1, v2))
+        if not self.copies.get(ends):
+            raise ValueError('No edge {}'.format((v1, v2)))
+        # a copy in the orientation of the arguments, so the other copies keep the orientations they were added in
+        copies = self.copies[ends]
+        i = copies.pop(max((n for n, j in enumerate(copies) if self.edges[j] == (v1, v2)), default=len(copies) - 1))
+        self.active.remove(i)
+        self.coloring.pop(i, None)
+        self.inactive.setdefault(ends, []).append(i)
+        if not self.stale:
+            self.fast_updates += 1
+
+    def check(self, stats=None):
+        #returns a k-edge-coloring of the active edges, or None if there is none
+        if stats is None:
+            stats = {}
+        if not self.stale:
+            stats['status'] = 'sat'
+            return {self.edges[i]: c for i, c in self.coloring.items()}
+        if hasattr(self.s, 'set_initial_value'):
+            # warm start: the edges without a color get a color that is free at their ends, if there is one
+            for i in self.active:
+                if i not in self.coloring:
+                    c = self.free_color(*self.edges[i])
+                    if c is not None:
+                        self.s.set_initial_value(self.variables[i][c], True)
+        self.calls += 1
+        res = self.s.check([self.existence[i] for i in self.active])
+        stats['status'] = str(res)
+        if res != sat:
+            return None
+        m = self.s.model()
+        self.coloring = {i: next(c for c in range(self.k) if is_true(m[self.variables[i][c]])) for i in self.active}
+        self.stale = False
+        return {self.edges[i]: c for i, c in self.coloring.items()}
+
+
+# the configurations that race in get_k_edge_coloring_portfolio
+EDGE_COLORING_PORTFOLIO = [
+    dict(),
+    dict(logic='QF_FD'),
+    dict(seed=1),
+    dict(logic='QF_FD', seed=2),
+]
+
+
+def get_k_edge_coloring_portfolio(k, V, E, configurations=EDGE_COLORING_PORTFOLIO, timeout=None):
+    #races the configurations of get_k_edge_coloring, and returns the answer of the first one to finish
+    coloring, winner, stats = run_portfolio(get_k_edge_coloring, (k, V, E), configurations, timeout)
+    if winner is None:
+        print("No configuration finished")
+        return None
+    print("Configuration {} won: {}".format(winner, configurations[winner]))
+    return coloring
 
 
 def draw_graph(V, E, coloring={}, filename='graph', engine='circo', directed=False):
@@ -273,6 +814,295 @@ def run_tests():
         res2 = get_k_edge_coloring_core(k, V, E)
         draw_graph(V, E, res2, f'coloring-or-core-{t["name"]}-{k}')
 
+        print("\nget_k_edge_coloring_portfolio:")
+        res3 = get_k_edge_coloring_portfolio(k, V, E)
+        assert (res1 is None) == (res3 is None)
+
+
+def benchmark_adjacency(sizes=(250, 500, 1000, 2000, 4000), k=3, seed=0):
+    """
+    time of finding the adjacent edge pairs against the number of edges, for the quadratic comparison
+    of all edge pairs and for the vertex incidence index, on random sparse graphs. The time of adding
+    their clauses to a solver is the same for both, and is shown separately
+    """
+    rng = random.Random(seed)
+    print("\n=== Adjacency benchmark ===")
+    for m in sizes:
+        n = m // 2 # average degree 4
+        E = list({(min(u, v), max(u, v)) for u, v in
+                  ((rng.randrange(n), rng.randrange(n)) for i in range(m)) if u != v})
+        times = []
+        pair_sets = []
+        for pairs_of in [adjacent_edge_pairs_quadratic, adjacent_edge_pairs]:
+            start_time = time.perf_counter()
+            pair_sets.append(set(pairs_of(E)))
+            times.append(time.perf_counter() - start_time)
+        assert pair_sets[0] == pair_sets[1]
+
+        start_time = time.perf_counter()
+        variables = [[Bool('e_{}_color_{}'.format(e, c)) for c in range(k)] for e in range(len(E))]
+        s = Solver()
+        for i, j in pair_sets[1]:
+            for c in range(k):
+                s.add(Or(Not(variables[i][c]), Not(variables[j][c])))
+        clause_time = time.perf_counter() - start_time
+        print("{} edges, {} adjacent pairs: all pairs {:.4f}s, incidence index {:.4f}s, clauses {:.4f}s".format(
+            len(E), len(pair_sets[0]), times[0], times[1], clause_time))
+
+
+def benchmark_amo():
+    print("\n=== At most one encodings ===")
+    benchmark_amo_encodings("Petersen, k=3", get_k_edge_coloring, (3, Petersen_V, Petersen_E), presolve=False, heuristic=False)
+    V, E = random_graph(30, 0.25)
+    benchmark_amo_encodings("random graph ({} edges), k=15".format(len(E)), get_k_edge_coloring, (15, V, E), presolve=False, heuristic=False)
+    benchmark_amo_encodings("random graph ({} edges), k=15, core".format(len(E)), get_k_edge_coloring_core, (15, V, E), presolve=False)
+
+
+def benchmark_symmetry():
+    #UNSAT instances at k = max degree, that presolve doesn't decide
+    print("\n=== Symmetry breaking ===")
+    benchmark_symmetry_breaking("Petersen, k=3", get_k_edge_coloring, (3, Petersen_V, Petersen_E), presolve=False, heuristic=False)
+    for n in [5, 7, 9]:
+        V = list(range(n))
+        E = [(v1, v2) for v1 in V for v2 in V if v1 < v2]
+        benchmark_symmetry_breaking("K{}, k={}".format(n, n - 1), get_k_edge_coloring, (n - 1, V, E))
+        if n < 9: # the core of K9 takes minutes without symmetry breaking
+            benchmark_symmetry_breaking("K{}, k={}, core".format(n, n - 1), get_k_edge_coloring_core, (n - 1, V, E))
+
+
+def benchmark_cores():
+    #overfull graphs - more than max degree * (n - 1) / 2 edges on an odd number n of vertices - have
+    #no max degree edge coloring, and every overfull subgraph is a core
+    print("\n=== Core minimization ===")
+    benchmark_core_modes("Petersen, k=3", get_k_edge_coloring_core, (3, Petersen_V, Petersen_E), presolve=False)
+    for n in [5, 7]:
+        V = list(range(n))
+        E = [(v1, v2) for v1 in V for v2 in V if v1 < v2]
+        benchmark_core_modes("K{}, k={}".format(n, n - 1), get_k_edge_coloring_core, (n - 1, V, E),
+                             symmetry_breaking=True)
+
+
+def test_chromatic_index(n=10, graphs=30, seed=0):
+    """
+    compares chromatic_index, with and without presolve, to get_k_edge_coloring at max degree on random graphs
+    """
+    rng = random.Random(seed)
+    print("\n=== Chromatic index ===")
+    for g in range(graphs):
+        V = list(range(n))
+        E = [(u, v) for u in V for v in V if u < v and rng.random() < rng.choice([0.2, 0.5, 0.8])]
+        with contextlib.redirect_stdout(io.StringIO()):
+            expected = max_degree(E) if get_k_edge_coloring(max_degree(E), V, E) is not None else max_degree(E) + 1
+            for options in [dict(), dict(presolve=False), dict(presolve=False, symmetry_breaking=True)]:
+                k, coloring = chromatic_index(V, E, **options)
+                assert k == expected and is_k_edge_coloring(k, E, coloring), (E, options)
+    # K5, K7: complete graphs on an odd number of vertices need max degree + 1 colors
+    for m in [5, 7]:
+        V = list(range(m))
+        E = [(u, v) for u in V for v in V if u < v]
+        stats = {}
+        print("K{}:".format(m), chromatic_index(V, E, symmetry_breaking=True, stats=stats)[0], "colors,",
+              stats['calls'], "calls")
+
+
+def test_session(n=16, edits=100, seed=0):
+    """
+    random edits of a graph in an EdgeColoringSession, every check against a new get_k_edge_coloring,
+    and the time of the updates and checks against rebuilding from scratch on a larger graph.
+    k is the max degree, and the edits keep it, so the checks that need the solver are the hard ones
+    """
+    rng = random.Random(seed)
+    print("\n=== Edge coloring session ===")
+    V, E = random_graph(n, 0.3, seed)
+    k = max_degree(E)
+    session = EdgeColoringSession(k, E)
+    E = list(E)
+    for t in range(edits):
+        if E and rng.random() < 0.5:
+            edge = E.pop(rng.randrange(len(E)))
+            session.remove_edge(*(edge if rng.random() < 0.5 else edge[::-1])) # in either orientation
+        else:
+            u, v = rng.sample(V, 2)
+            edge = (min(u, v), max(u, v))
+            degrees = incident_edges(E)
+            if edge in E or max(len(degrees.get(u, [])), len(degrees.get(v, []))) == k:
+                continue
+            E.append(edge)
+            session.add_edge(*edge)
+        coloring = session.check()
+        with contextlib.redirect_stdout(io.StringIO()):
+            expected = get_k_edge_coloring(k, V, E, presolve=False)
+        assert (coloring is None) == (expected is None)
+        assert coloring is None or (set(coloring) == set(E) and is_k_edge_coloring(k, E, coloring))
+    print("{} edits: {} solver calls, {} updates without the solver".format(edits, session.calls, session.fast_updates))
+
+    # parallel copies in both orientations: removing one keeps the other in the orientation it was added in
+    session = EdgeColoringSession(2)
+    session.add_edge(0, 1)
+    session.add_edge(1, 0)
+    session.remove_edge(0, 1)
+    assert set(session.check()) == {(1, 0)}
+
+    V, E = random_graph(100, 0.05, seed)
+    k = max_degree(E) + 1
+    session = EdgeColoringSession(k, E)
+    session.check()
+    update_times, check_times = [], []
+    for t in range(50):
+        edge = E[rng.randrange(len(E))]
+        start_time = time.perf_counter()
+        session.remove_edge(*edge)
+        session.add_edge(*edge)
+        update_times.append(time.perf_counter() - start_time)
+        start_time = time.perf_counter()
+        session.check()
+        check_times.append(time.perf_counter() - start_time)
+    start_time = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        # without presolve and the heuristic, that would answer without the solver
+        get_k_edge_coloring(k, V, E, presolve=False, heuristic=False)
+    print("{} edges, k={}: update {:.6f}s, check {:.6f}s on average, rebuild {:.3f}s".format(
+        len(E), k, sum(update_times) / len(update_times), sum(check_times) / len(check_times),
+        time.perf_counter() - start_time))
+
+
+def test_enumeration(graphs=20, seed=0):
+    """
+    counts the colorings of small random graphs against all the assignments of colors to the edges
+    """
+    rng = random.Random(seed)
+    print("\n=== Enumeration ===")
+    for g in range(graphs):
+        V = list(range(rng.randint(2, 6)))
+        E = [(u, v) for u in V for v in V if u < v and rng.random() < 0.5][:8]
+        k = rng.randint(1, 3)
+        colorings = [dict(zip(E, colors)) for colors in itertools.product(range(k), repeat=len(E))]
+        colorings = [coloring for coloring in colorings if is_k_edge_coloring(k, E, coloring)]
+        # the same up to renaming of the colors: the same partition of the edges
+        partitions = set(frozenset(frozenset(e for e in E if coloring[e] == c) for c in set(coloring.values()))
+                         for coloring in colorings)
+        stats = {}
+        assert sum(1 for coloring in enumerate_k_edge_colorings(k, V, E, stats=stats)) == len(colorings)
+        assert stats['complete']
+        assert sum(1 for coloring in enumerate_k_edge_colorings(k, V, E, modulo_permutations=True)) == len(partitions)
+    stats = {}
+    for coloring in enumerate_k_edge_colorings(4, Petersen_V, Petersen_E, limit=1000, stats=stats):
+        assert is_k_edge_coloring(4, Petersen_E, coloring)
+    print("Petersen, k=4: {} colorings (complete: {})".format(stats['count'], stats['complete']))
+    stats = {}
+    for coloring in enumerate_k_edge_colorings(4, Petersen_V, Petersen_E, modulo_permutations=True, timeout=10,
+                                               stats=stats):
+        pass
+    print("Petersen, k=4, up to renaming of the colors: {} colorings (complete: {})".format(
+        stats['count'], stats['complete']))
+
+
+def union_of_matchings(n, matchings, seed=0):
+    #a graph on n (even) vertices made of random perfect matchings, so almost all the degrees are the max degree
+    rng = random.Random(seed)
+    E = set()
+    for m in range(matchings):
+        order = list(range(n))
+        rng.shuffle(order)
+        E |= set((min(order[i], order[i + 1]), max(order[i], order[i + 1])) for i in range(0, n, 2))
+    return list(range(n)), sorted(E)
+
+
+def benchmark_heuristic(graphs=10, seed=0):
+    """
+    how often the DSatur coloring alone has max degree colors, on graphs where presolve doesn't decide,
+    and the time with and without the heuristic
+    """
+    print("\n=== DSatur heuristic ===")
+    families = [("random graphs (40 vertices)", lambda g: random_graph(40, 0.2, seed + g)),
+                ("unions of 5 matchings (30 vertices)", lambda g: union_of_matchings(30, 5, seed + g))]
+    for name, make_graph in families:
+        successes = 0
+        times = [0, 0]
+        for g in range(graphs):
+            V, E = make_graph(g)
+            k = max_degree(E)
+            results = []
+            for i, heuristic in enumerate([False, True]):
+                stats = {}
+                start_time = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    results.append(get_k_edge_coloring(k, V, E, heuristic=heuristic, stats=stats))
+                times[i] += time.perf_counter() - start_time
+                if heuristic and stats.get('heuristic') == 'coloring':
+                    successes += 1
+            assert (results[0] is None) == (results[1] is None)
+            assert results[1] is None or is_k_edge_coloring(k, E, results[1])
+        print("{}: DSatur alone colored {} of {} with max degree colors; solver only {:.3f}s, with the heuristic {:.3f}s".format(
+            name, successes, graphs, times[0], times[1]))
+
+
+def test_presolve(n=12, graphs=40, seed=0):
+    """
+    compares the answers of presolve_k_edge_coloring to the solver on random graphs
+    """
+    rng = random.Random(seed)
+    print("\n=== Presolve ===")
+    rules = dict()
+    for g in range(graphs):
+        p = rng.choice([0.15, 0.3, 0.5])
+        V = list(range(n))
+        E = [(u, v) for u in V for v in V if u < v and rng.random() < p]
+        if rng.random() < 0.3:
+            # a bipartite graph
+            E = [(u, v) for u, v in E if u % 2 != v % 2]
+        delta = max_degree(E)
+        for k in range(max(delta - 1, 0), delta + 2):
+            status, result, rule = presolve_k_edge_coloring(k, E)
+            rules[rule] = rules.get(rule, 0) + 1
+            with contextlib.redirect_stdout(io.StringIO()):
+                expected = get_k_edge_coloring(k, V, E, presolve=False)
+            if status == 'sat':
+                assert expected is not None and is_k_edge_coloring(k, E, result)
+            elif status == 'unsat':
+                assert expected is None
+                with contextlib.redirect_stdout(io.StringIO()):
+                    assert get_k_edge_coloring(k, V, result, presolve=False) is None
+    print("decided by:", rules)
+
+
+def benchmark_components(copies=(4, 8, 16), n=14, p=0.5, workers=4, seed=0):
+    """
+    time of k-edge-coloring disjoint random graphs as one instance, component by component,
+    and with a pool of workers. k is the max degree of the whole graph, so presolve can decide
+    only the components with lower degrees, or that are bipartite
+    """
+    print("\n=== Components benchmark ===")
+    for copies_count in copies:
+        E = []
+        for i in range(copies_count):
+            _, component = random_graph(n, p, seed + i)
+            E += [(n * i + v1, n * i + v2) for v1, v2 in component]
+        V = list(range(n * copies_count))
+        k = max_degree(E)
+        times = []
+        colorings = []
+        for options in [dict(decompose=False), dict(), dict(workers=workers)]:
+            start_time = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                # without the heuristic, that colors these graphs without the solver
+                colorings.append(get_k_edge_coloring(k, V, E, heuristic=False, **options))
+            times.append(time.perf_counter() - start_time)
+        assert all((coloring is None) == (colorings[0] is None) for coloring in colorings)
+        print("{} components, {} edges, k={}: one instance {:.3f}s, by components {:.3f}s, {} workers {:.3f}s".format(
+            copies_count, len(E), k, times[0], times[1], workers, times[2]))
+
 
 if __name__ == '__main__':
-    run_tests()
\ No newline at end of file
+    run_tests()
+    test_presolve()
+    test_chromatic_index()
+    test_session()
+    test_enumeration()
+
+    benchmark_adjacency()
+    benchmark_amo()
+    benchmark_symmetry()
+    benchmark_cores()
+    benchmark_heuristic(graphs=3)
+    benchmark_components()
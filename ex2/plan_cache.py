@@ -0,0 +1,200 @@
+"""
+A persistent cache of transport plans, shared by problems that are equal up to renaming of the
+cities, the packages and the airplanes.
+"""
+import json
+import sqlite3
+
+try:
+    from .planning import get_transport_plan
+except ImportError: # run as a script, not as a part of the ex2 package
+    from planning import get_transport_plan
+
+# the canonical form tries at most this many orders of the cities, above that the search follows only the
+# first choice. The key is still the problem under an actual renaming, so the cache stays correct, but some
+# renamings of the same problem may get different keys
+MAX_LEAVES = 720
+
+
+def refine(colors, src, dst):
+    #color refinement of the cities: cities stay in the same class only if their packages go to and come from
+    #the same classes. The colors are numbered by their signatures, so they don't depend on the names
+    out_packages = [[] for c in colors]
+    in_packages = [[] for c in colors]
+    for p in range(len(src)):
+        out_packages[src[p]].append(p)
+        in_packages[dst[p]].append(p)
+    while True:
+        signatures = [(colors[c],
+                       tuple(sorted(colors[dst[p]] for p in out_packages[c])),
+                       tuple(sorted(colors[src[p]] for p in in_packages[c])))
+                      for c in range(len(colors))]
+        numbers = {signature: i for i, signature in enumerate(sorted(set(signatures)))}
+        refined = [numbers[signature] for signature in signatures]
+        if len(numbers) == len(set(colors)):
+            return refined
+        colors = refined
+
+
+def canonical_cities(nc, src, dst, start, max_leaves=MAX_LEAVES):
+    """
+    Returns (key, cities), where cities[k] is the city that is renamed to k, and key is the problem
+    after the renaming - the smallest one found over the orders of the cities that color refinement
+    can't tell apart.
+    """
+    has_packages = [False] * nc
+    for p in range(len(src)):
+        has_packages[src[p]] = has_packages[dst[p]] = True
+    leaves = [0]
+    best = [None, None]
+
+    def search(colors):
+        colors = refine(colors, src, dst)
+        cells = dict()
+        for c in range(nc):
+            cells.setdefault(colors[c], []).append(c)
+        # cities without packages that are in the same class are interchangeable, there is no need to branch on them
+        branching = [cells[color] for color in sorted(cells) if len(cells[color]) > 1 and has_packages[cells[color][0]]]
+        if not branching:
+            leaves[0] += 1
+            cities = sorted(range(nc), key=lambda c: (colors[c], c))
+            renamed = {c: k for k, c in enumerate(cities)}
+            key = (nc,
+                   tuple(sorted((renamed[src[p]], renamed[dst[p]]) for p in range(len(src)))),
+                   tuple(sorted(renamed[c] for c in start)))
+            if best[0] is None or key < best[0]:
+                best[0], best[1] = key, cities
+            return
+        for v in branching[0]:
+            if leaves[0] >= max_leaves and best[0] is not None:
+                return
+            search([(colors[c], 0 if c == v else 1) for c in range(nc)])
+
+    search([sum(1 for a in start if a == c) for c in range(nc)])
+    return best[0], best[1]
+
+
+class PlanCache:
+    """
+    An on-disk (sqlite) cache in front of get_transport_plan. Plans are stored in the names of the
+    canonical problem, together with the (minimal) horizon and number of moves, and are renamed
+    back to the names of the caller. When there are more than max_entries plans, the least
+    recently used ones are evicted.
+    """
+
+    def __init__(self, path, max_entries=1000):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.db = sqlite3.connect(path)
+        self.db.execute('CREATE TABLE IF NOT EXISTS plans '
+                        '(key TEXT PRIMARY KEY, plan TEXT, t_finish INTEGER, moves INTEGER, last_used INTEGER)')
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def next_use(self):
+        return self.db.execute('SELECT COALESCE(MAX(last_used), 0) + 1 FROM plans').fetchone()[0]
+
+    def lookup(self, key):
+        row = self.db.execute('SELECT plan, t_finish, moves FROM plans WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        self.db.execute('UPDATE plans SET last_used = ? WHERE key = ?', (self.next_use(), key))
+        self.db.commit()
+        return json.loads(row[0]), row[1], row[2]
+
+    def store(self, key, plan):
+        city_packages, city_airplanes, airplane_packages = plan
+        t_finish = len(city_airplanes) - 1
+        location = lambda t, a: next(c for c, airplanes in enumerate(city_airplanes[t]) if a in airplanes)
+        na = sum(len(airplanes) for airplanes in city_airplanes[0])
+        moves = sum(1 for t in range(1, t_finish + 1) for a in range(na) if location(t, a) != location(t - 1, a))
+        self.db.execute('INSERT OR REPLACE INTO plans VALUES (?, ?, ?, ?, ?)',
+                        (key, json.dumps(plan), t_finish, moves, self.next_use()))
+        # evict the least recently used plans
+        self.db.execute('DELETE FROM plans WHERE key IN '
+                        '(SELECT key FROM plans ORDER BY last_used DESC LIMIT -1 OFFSET ?)', (self.max_entries,))
+        self.db.commit()
+        return t_finish, moves
+
+    def get_transport_plan(self, nc, np, na, src, dst, start, stats=None, **options):
+        """
+        Same as get_transport_plan, options are passed to it on a miss.
+        stats is filled with 'cache' ('hit' or 'miss'), the status, and the horizon and the moves of the plan.
+        """
+        if stats is None:
+            stats = {}
+        if np < 0 or nc < 0 or na < 0 or (na == 0 and np > 0):
+            return get_transport_plan(nc, np, na, src, dst, start, stats=stats, **options)
+
+        key, cities = canonical_cities(nc, src, dst, start)
+        renamed = {c: k for k, c in enumerate(cities)}
+        # packages and airplanes are renamed by sorting them by their renamed cities
+        packages = sorted(range(np), key=lambda p: (renamed[src[p]], renamed[dst[p]], p))
+        airplanes = sorted(range(na), key=lambda a: (renamed[start[a]], a))
+
+        key = json.dumps(key)
+        cached = self.lookup(key)
+        if cached is not None:
+            self.hits += 1
+            stats['cache'] = 'hit'
+            stats['status'] = 'sat' # only plans are cached
+            canonical_plan, stats['t_finish'], stats['moves'] = cached
+        else:
+            self.misses += 1
+            stats['cache'] = 'miss'
+            canonical_plan = get_transport_plan(nc, np, na,
+                                                [renamed[src[p]] for p in packages],
+                                                [renamed[dst[p]] for p in packages],
+                                                [renamed[start[a]] for a in airplanes],
+                                                stats=stats, **options)
+            if canonical_plan is None:
+                return None
+            stats['t_finish'], stats['moves'] = self.store(key, canonical_plan)
+
+        # rename the plan back to the names of the caller
+        city_packages, city_airplanes, airplane_packages = [], [], []
+        for t in range(len(canonical_plan[0])):
+            city_packages.append([None] * nc)
+            city_airplanes.append([None] * nc)
+            airplane_packages.append([None] * na)
+            for k in range(nc):
+                city_packages[t][cities[k]] = sorted(packages[i] for i in canonical_plan[0][t][k])
+                city_airplanes[t][cities[k]] = sorted(airplanes[j] for j in canonical_plan[1][t][k])
+            for j in range(na):
+                airplane_packages[t][airplanes[j]] = sorted(packages[i] for i in canonical_plan[2][t][j])
+        return city_packages, city_airplanes, airplane_packages
+
+
+if __name__ == '__main__':
+    import os
+    import random
+    import tempfile
+    from planning import example_problem, print_problem, print_plan
+
+    path = os.path.join(tempfile.mkdtemp(), 'plans.db')
+    cache = PlanCache(path, max_entries=2)
+    print_problem(**example_problem)
+    print_plan(*cache.get_transport_plan(**example_problem))
+
+    # the same problem with cities, packages and airplanes renamed
+    rng = random.Random(0)
+    nc, np, na = example_problem['nc'], example_problem['np'], example_problem['na']
+    city_names = list(range(nc))
+    package_names = list(range(np))
+    airplane_names = list(range(na))
+    rng.shuffle(city_names)
+    rng.shuffle(package_names)
+    rng.shuffle(airplane_names)
+    renamed_problem = dict(nc=nc, np=np, na=na,
+                           src=[city_names[example_problem['src'][p]] for p in package_names],
+                           dst=[city_names[example_problem['dst'][p]] for p in package_names],
+                           start=[city_names[example_problem['start'][a]] for a in airplane_names])
+    print_problem(**renamed_problem)
+    stats = {}
+    print_plan(*cache.get_transport_plan(**renamed_problem, stats=stats))
+    print("cache:", stats['cache'], "horizon:", stats['t_finish'], "moves:", stats['moves'])
+    print("hits: {}, misses: {}".format(cache.hits, cache.misses))
+    cache.close()
@@ -1,8 +1,20 @@
 """
 Transport planning problem exercise.
 """
+import concurrent.futures
+import contextlib
+import io
+import multiprocessing
+import random
+import time
+
 from z3 import *
 
+try:
+    from .portfolio import run_portfolio
+except ImportError: # run as a script, not as a part of the ex2 package
+    from portfolio import run_portfolio
+
 
 example_problem = dict(
     nc=4,
@@ -103,18 +115,145 @@ def decalre_consts(nc, np, na, C, P, A):
     return cities, packages, airplanes
 
 
-def basic_start_end_conditions(packages, cities, airplanes, at, on, loc, src, dst, start, t_finish, s):
-    #add conditions for source and destination for all packages
+def define_uf_encoding(nc, np, na):
+    #cities, packages and airplanes are constants of uninterpreted sorts, and the state is given by functions over them
+    C, P, A, at, loc, on = define_sorts()
+    cities, packages, airplanes = decalre_consts(nc, np, na, C, P, A)
+    plane_at = lambda a, c, t: loc(a, t) == c
+    moved = lambda a, t: loc(a, t) != loc(a, t - 1)
+    return cities, packages, airplanes, at, on, plane_at, moved
+
+
+def grounded(name):
+    #returns a function from indices to Bool variables, every variable is created only once.
+    #var.variables maps the indices to the variables created so far, and var.decls maps the id of
+    #the declaration of every variable to its indices
+    variables = dict()
+    decls = dict()
+    def var(*indices):
+        if indices not in variables:
+            variables[indices] = Bool(name + ''.join('_{}'.format(i) for i in indices))
+            decls[variables[indices].decl().get_id()] = indices
+        return variables[indices]
+    var.variables = variables
+    var.decls = decls
+    return var
+
+
+def define_bool_encoding(nc, np, na):
+    #cities, packages and airplanes are plain indices, and every fact of the state is its own Bool,
+    #so the problem is purely propositional
+    cities, packages, airplanes = list(range(nc)), list(range(np)), list(range(na))
+    at = grounded('at') # at(p, c, t)
+    on = grounded('on') # on(p, a, t)
+    plane_at = grounded('loc') # plane_at(a, c, t)
+    moved = lambda a, t: Or([And(plane_at(a, c, t - 1), Not(plane_at(a, c, t))) for c in cities])
+    return cities, packages, airplanes, at, on, plane_at, moved
+
+
+ENCODINGS = {
+    'uf': define_uf_encoding,
+    'bool': define_bool_encoding,
+}
+
+
+def basic_start_conditions(packages, cities, airplanes, at, on, plane_at, src, start, s):
+    #add conditions for source of all packages
     for i,p in enumerate(packages):
         s.add(at(p, cities[src[i]], 0))
-        s.add(at(p, cities[dst[i]], t_finish))
     
     #add conditions for start position of planes
     for i,a in enumerate(airplanes):
-        s.add(loc(a, 0) == cities[start[i]])
+        s.add(plane_at(a, cities[start[i]], 0))
+
 
+def add_goal(packages, cities, at, dst, t_finish, s):
+    #the destinations at time t_finish are guarded by a literal, so the goal is only enforced
+    #for the horizon that is currently checked (by passing the literal as an assumption)
+    goal = Bool(f'goal_{t_finish}')
+    s.add(Implies(goal, And([at(p, cities[dst[i]], t_finish) for i,p in enumerate(packages)])))
+    return goal
 
-def add_package_constraints(s, p, t, cities, airplanes, at, on, loc):
+
+def add_time_step(s, t, packages, cities, airplanes, at, on, plane_at, moved):
+    #adds only the constraints of time step t, and returns the airplane moves between t-1 and t
+    airplane_moves = []
+    #add condition for plane to be at one city
+    for a in airplanes:
+        vars_for_in_cities = [plane_at(a, c, t) for c in cities]
+        s.add(PbEq([(v, 1) for v in vars_for_in_cities], 1))
+        if t > 0:
+            #for optimization:
+            airplane_moves.append(If(moved(a, t), 1, 0))# the plane adds a move if it moved
+
+    #add conditions for packages 
+    for p in packages:
+        add_package_constraints(s, p, t, cities, airplanes, at, on, plane_at)
+    return airplane_moves
+
+
+def encode_up_to(s, airplane_moves, t_finish, packages, cities, airplanes, at, on, plane_at, moved, symmetry=None):
+    #adds the time steps that are not encoded yet up to t_finish (airplane_moves holds the moves of
+    #every encoded time step), and returns the airplane moves until t_finish
+    while len(airplane_moves) <= t_finish:
+        t = len(airplane_moves)
+        airplane_moves.append(add_time_step(s, t, packages, cities, airplanes, at, on, plane_at, moved))
+        if symmetry is not None:
+            add_symmetry_breaking(s, t, symmetry, packages, cities, airplanes, at, on, plane_at)
+    return [m for step_moves in airplane_moves[1:t_finish + 1] for m in step_moves]
+
+
+def equal_groups(items):
+    #the groups of indices of equal items, only groups with more than one index
+    groups = dict()
+    for i, x in enumerate(items):
+        groups.setdefault(x, []).append(i)
+    return [g for g in groups.values() if len(g) > 1]
+
+
+def new_symmetry_breaking(src, dst, start):
+    #airplanes that start at the same city are interchangeable, and so are packages with the same source
+    #and destination. The last item keeps, per pair of compared members, the literal that says that
+    #their states were equal so far
+    return equal_groups(start), equal_groups(list(zip(src, dst))), dict()
+
+
+def add_lex_step(s, prefix_equal, xs, ys, name):
+    #continues a lexicographic xs <= ys comparison (False < True) whose earlier part is equal if prefix_equal
+    #holds, and returns the literal that holds if it is still equal after xs and ys
+    for k, (x, y) in enumerate(zip(xs, ys)):
+        s.add(Implies(prefix_equal, Implies(x, y)))
+        equal = Bool('{}_{}'.format(name, k))
+        s.add(Implies(And(prefix_equal, x == y), equal))
+        prefix_equal = equal
+    return prefix_equal
+
+
+def add_symmetry_breaking(s, t, symmetry, packages, cities, airplanes, at, on, plane_at):
+    #orders every two consecutive members of a symmetry class by their states at time 0, 1, ..., t.
+    #all the orders are taken from one order of the variables - first all the airplane locations and then
+    #the package states package by package - so together they still keep one plan of every symmetric group.
+    #Since the comparison continues step by step, it can be extended with the time steps
+    airplane_classes, package_classes, prefix_equal = symmetry
+    for group in airplane_classes:
+        for i, j in zip(group, group[1:]):
+            key = ('A', i, j)
+            prefix_equal[key] = add_lex_step(
+                s, prefix_equal.get(key, BoolVal(True)),
+                [plane_at(airplanes[i], c, t) for c in cities],
+                [plane_at(airplanes[j], c, t) for c in cities],
+                'sym_A{}_A{}_{}'.format(i, j, t))
+    for group in package_classes:
+        for i, j in zip(group, group[1:]):
+            key = ('P', i, j)
+            prefix_equal[key] = add_lex_step(
+                s, prefix_equal.get(key, BoolVal(True)),
+                [at(packages[i], c, t) for c in cities] + [on(packages[i], a, t) for a in airplanes],
+                [at(packages[j], c, t) for c in cities] + [on(packages[j], a, t) for a in airplanes],
+                'sym_P{}_P{}_{}'.format(i, j, t))
+
+
+def add_package_constraints(s, p, t, cities, airplanes, at, on, plane_at):
     #being on one plane/at one city
     vars_for_at_cities = [at(p, c, t) for c in cities]
     vars_for_on_planes = [on(p, a, t) for a in airplanes]
@@ -124,7 +263,7 @@ def add_package_constraints(s, p, t, cities, airplanes, at, on, loc):
     # if a package is at a city then it either stayed there or was unloaded there.
     for c in cities:
         was_unloaded_from_a_plane = Or(*[And(
-            on(p,a,t-1), loc(a,t-1) == c, loc(a,t) == c
+            on(p,a,t-1), plane_at(a,c,t-1), plane_at(a,c,t)
         ) for a in airplanes])
         
         s.add(Implies(
@@ -138,7 +277,7 @@ def add_package_constraints(s, p, t, cities, airplanes, at, on, loc):
     # if a package is on a plane it either stayed there or was loaded there
     for a in airplanes:
         was_loaded_in_a_city = Or(*[And(
-            at(p,c,t-1), loc(a,t-1) == c, loc(a,t) == c #loc(a,t-1) == c, loc(a,t) == c means it stayed
+            at(p,c,t-1), plane_at(a,c,t-1), plane_at(a,c,t) #plane_at(a,c,t-1), plane_at(a,c,t) means it stayed
         ) for c in cities])
         
         s.add(Implies(
@@ -151,7 +290,104 @@ def add_package_constraints(s, p, t, cities, airplanes, at, on, loc):
 
 
 
-def extract_plan_from_model(model, cities, packages, airplanes, t_finish, at, on, loc):
+def read_function(model, name):
+    #reads the interpretation of the function called name once: returns a dict from the arguments
+    #(sort elements by their id, integers by their value) to the value, and the else value
+    decls = [d for d in model.decls() if d.name() == name]
+    if not decls:
+        return dict(), None
+    interp = model[decls[0]]
+    entries = dict()
+    for entry in interp.as_list()[:-1]:
+        key = tuple(x.as_long() if is_int_value(x) else x.get_id() for x in entry[:-1])
+        entries[key] = entry[-1]
+    return entries, interp.else_value()
+
+
+def extract_plan_from_uf_interpretations(model, cities, packages, airplanes, t_finish, at, on, plane_at):
+    np = len(packages)
+    na = len(airplanes)
+    element = lambda x: model.eval(x, model_completion=True).get_id()
+    city_ids = [element(c) for c in cities]
+    package_ids = [element(p) for p in packages]
+    airplane_ids = [element(a) for a in airplanes]
+
+    def holds(interpretation, key, term):
+        entries, else_value = interpretation
+        value = entries.get(key, else_value)
+        if value is None or not (is_true(value) or is_false(value)):
+            value = model.eval(term()) # the value is not a constant, evaluate this cell on its own
+        return is_true(value)
+
+    at_interpretation = read_function(model, 'at')
+    on_interpretation = read_function(model, 'on')
+    loc_entries, loc_else = read_function(model, 'loc')
+
+    city_packages = [
+        [
+            [i for i in range(np) if holds(at_interpretation, (package_ids[i], city_ids[j], t),
+                                           lambda: at(packages[i], c, t))]
+            for j, c in enumerate(cities)
+        ]
+        for t in range(t_finish + 1)
+    ]
+
+    city_airplanes = [[[] for c in cities] for t in range(t_finish + 1)]
+    for t in range(t_finish + 1):
+        for i in range(na):
+            value = loc_entries.get((airplane_ids[i], t), loc_else)
+            if value is not None and is_const(value):
+                for j in range(len(cities)):
+                    if city_ids[j] == value.get_id():
+                        city_airplanes[t][j].append(i)
+            else:
+                for j, c in enumerate(cities):
+                    if is_true(model.eval(plane_at(airplanes[i], c, t))):
+                        city_airplanes[t][j].append(i)
+
+    airplane_packages = [
+        [
+            [i for i in range(np) if holds(on_interpretation, (package_ids[i], airplane_ids[j], t),
+                                           lambda: on(packages[i], a, t))]
+            for j, a in enumerate(airplanes)
+        ]
+        for t in range(t_finish + 1)
+    ]
+    return city_packages, city_airplanes, airplane_packages
+
+
+def extract_plan_from_bool_model(model, cities, packages, airplanes, t_finish, at, on, plane_at):
+    #the constants of the model are walked once with the C API, without a Python object for every one of them,
+    #and the ones that are true are placed in the tables by the ids of their declarations
+    city_packages = [[[] for c in cities] for t in range(t_finish + 1)]
+    city_airplanes = [[[] for c in cities] for t in range(t_finish + 1)]
+    airplane_packages = [[[] for a in airplanes] for t in range(t_finish + 1)]
+    # at(p, c, t), plane_at(a, c, t) and on(p, a, t)
+    tables = [(at.decls, city_packages), (plane_at.decls, city_airplanes), (on.decls, airplane_packages)]
+    ctx, m = model.ctx.ref(), model.model
+    for i in range(Z3_model_get_num_consts(ctx, m)):
+        decl = Z3_model_get_const_decl(ctx, m, i)
+        if Z3_get_bool_value(ctx, Z3_model_get_const_interp(ctx, m, decl)) != Z3_L_TRUE:
+            continue
+        decl_id = Z3_get_ast_id(ctx, Z3_func_decl_to_ast(ctx, decl))
+        for decls, table in tables:
+            if decl_id in decls:
+                x, y, t = decls[decl_id]
+                if t <= t_finish:
+                    table[t][y].append(x)
+    for table in [city_packages, city_airplanes, airplane_packages]:
+        for row in table:
+            for cell in row:
+                cell.sort()
+    return city_packages, city_airplanes, airplane_packages
+
+
+def extract_plan_from_model(model, cities, packages, airplanes, t_finish, at, on, plane_at, encoding=None):
+    #with the encoding known, the interpretations are read in bulk, otherwise the model is evaluated cell by cell
+    if encoding == 'uf':
+        return extract_plan_from_uf_interpretations(model, cities, packages, airplanes, t_finish, at, on, plane_at)
+    elif encoding == 'bool':
+        return extract_plan_from_bool_model(model, cities, packages, airplanes, t_finish, at, on, plane_at)
     np = len(packages)
     na = len(airplanes)
     
@@ -165,7 +401,7 @@ def extract_plan_from_model(model, cities, packages, airplanes, t_finish, at, on
     
     city_airplanes = [
         [
-            [i for i in range(na) if is_true(model.eval(loc(airplanes[i], t) == c))] 
+            [i for i in range(na) if is_true(model.eval(plane_at(airplanes[i], c, t)))] 
             for c in cities
         ] 
         for t in range(t_finish + 1)
@@ -181,58 +417,319 @@ def extract_plan_from_model(model, cities, packages, airplanes, t_finish, at, on
     return city_packages, city_airplanes, airplane_packages    
 
 
-def get_transport_plan(nc, np, na, src, dst, start):
+def transport_bounds(nc, np, na, src, dst, start):
+    """
+    Cheap bounds on the minimal horizon, without the solver. Returns (lower, upper).
+    lower: a package that is already at its destination needs 0 steps, and otherwise it needs a plane
+    that stays at its source (load), flies and stays at its destination (unload) - 3 steps if a plane
+    starts at the source, and 4 if a plane has to fly there first. Also, every source and destination
+    needs some plane to stay there for 2 time points, so some plane stays at ceil(cities / na) of
+    them and needs 2 * ceil(cities / na) - 1 steps.
+    upper: the length of a plan where a single airplane serves the sources one by one - flies there
+    (if it is not there already), loads all the packages of the source, and then flies to and unloads
+    at each of their destinations.
+    """
+    moving = [p for p in range(np) if src[p] != dst[p]]
+    if not moving:
+        return 0, 0
+    lower = max(3 if src[p] in start else 4 for p in moving)
+    service_cities = set(src[p] for p in moving) | set(dst[p] for p in moving)
+    lower = max(lower, 2 * -(-len(service_cities) // na) - 1)
+
+    destinations = dict() # source -> destinations of its packages
+    for p in moving:
+        destinations.setdefault(src[p], set()).add(dst[p])
+    upper = None
+    for city in set(start):
+        t = 0
+        remaining = sorted(destinations)
+        while remaining:
+            # prefer the source the airplane is at
+            source = city if city in remaining else remaining[0]
+            remaining.remove(source)
+            t += (source != city) + 1 + 2 * len(destinations[source])
+            city = sorted(destinations[source])[-1]
+        upper = t if upper is None else min(upper, t)
+    return lower, upper
+
+
+def linear_horizon_search(check_horizon, t_start, t_limit):
+    #probe every horizon from t_start upwards, the first one with a plan is the minimal one
+    for t_finish in range(t_start, t_limit + 1):
+        model = check_horizon(t_finish)
+        if model is not None:
+            return t_finish, model
+    return None, None
+
+
+def exponential_horizon_search(check_horizon, t_start, t_limit):
+    #probe t_start, t_start+2, t_start+6, ... until a plan is found, and then binary search the
+    #horizons between the last one without a plan and the first one with a plan.
+    #this is correct since a plan of length t can always be extended to t+1 by waiting
+    lo = t_start # all horizons below lo have no plan
+    step = 1
+    while True:
+        t_finish = min(lo + step - 1, t_limit)
+        model = check_horizon(t_finish)
+        if model is not None:
+            break
+        if t_finish == t_limit:
+            return None, None
+        lo = t_finish + 1
+        step *= 2
+
+    hi = t_finish # hi is the smallest horizon known to have a plan
+    while lo < hi:
+        mid = (lo + hi) // 2
+        mid_model = check_horizon(mid)
+        if mid_model is not None:
+            hi, model = mid, mid_model
+        else:
+            lo = mid + 1
+    return hi, model
+
+
+HORIZON_STRATEGIES = {
+    'linear': linear_horizon_search,
+    'exponential': exponential_horizon_search,
+}
+
+
+def check_in_time(s, deadline, stats, *assumptions):
+    #checks s within the time that is left until the deadline (if there is one), unknown is an error
+    if deadline is not None:
+        s.set('timeout', max(1, int((deadline - time.perf_counter()) * 1000)))
+    res = s.check(*assumptions)
+    if res == unknown:
+        stats['status'] = 'unknown'
+        raise Exception('Got unknown from Z3')
+    return res
+
+
+def optimize_moves_at_horizon(t_finish, packages, cities, airplanes, at, on, plane_at, moved, src, dst, start,
+                              symmetry_breaking, deadline, stats):
+    #a single optimization of the airplane moves, only for the (already minimal) horizon t_finish
+    opt = Optimize()
+    symmetry = new_symmetry_breaking(src, dst, start) if symmetry_breaking else None
+    basic_start_conditions(packages, cities, airplanes, at, on, plane_at, src, start, opt)
+    moves = encode_up_to(opt, [], t_finish, packages, cities, airplanes, at, on, plane_at, moved, symmetry)
+    goal = add_goal(packages, cities, at, dst, t_finish, opt)
+    if moves:
+        opt.minimize(Sum(moves))
+    stats['optimization_calls'] += 1
+    res = check_in_time(opt, deadline, stats, goal)
+    assert res == sat
+    return opt.model()
+
+
+def tighten_moves_at_horizon(s, model, moves, goal, deadline, stats):
+    #keeps asking the (feasibility) solver for a plan with less moves than the last one it found
+    best = model.eval(Sum(moves)).as_long() if moves else 0
+    while best > 0:
+        bound = Bool(f'moves_below_{best}')
+        s.add(Implies(bound, Sum(moves) < best))
+        stats['optimization_calls'] += 1
+        res = check_in_time(s, deadline, stats, goal, bound)
+        if res == unsat:
+            break
+        model = s.model()
+        best = model.eval(Sum(moves)).as_long()
+    return model
+
+
+def get_transport_plan(nc, np, na, src, dst, start, strategy='linear', lower_bound=0, two_phase=False,
+                       tighten_moves=False, encoding='uf', symmetry_breaking=False, timeout=None, logic=None,
+                       bounds=True, stats=None):
+    """
+    strategy is one of HORIZON_STRATEGIES, lower_bound is a horizon that is known to have no shorter plan
+    (e.g. from a relaxation of the problem). With bounds, the search also starts no lower than the lower bound
+    of transport_bounds, and stops at its upper bound.
+    With two_phase the minimal horizon is found with a plain Solver, and only that horizon is optimized
+    for airplane moves - by one Optimize call, or with tighten_moves by repeatedly bounding the moves
+    of the last plan on the same Solver. logic picks the Solver of the two phase mode (e.g. 'QF_FD' for the
+    'bool' encoding), by default it is a general Solver.
+    encoding is one of ENCODINGS: 'uf' models the state with uninterpreted functions, and 'bool' grounds it
+    into plain Bool variables, which keeps the whole problem propositional.
+    With symmetry_breaking, interchangeable airplanes (same start) and packages (same source and destination)
+    are ordered lexicographically, so symmetric plans are not explored again.
+    timeout is the total time in seconds for all the solver calls, when it runs out Z3 returns unknown.
+    If stats is a dict, it is filled with the status ('sat', 'unsat', 'unknown' or 'illegal'), the number of
+    solver calls, the time of each phase, the number of symmetry classes, and the bounds on the horizon and
+    how many horizons below the lower bound were skipped.
+    """
+    if stats is None:
+        stats = {}
     if (np < 0 or nc < 0 or na < 0 or (na == 0 and np > 0)): 
         #illegal input
+        stats['status'] = 'illegal'
         return None
-    C, P, A, at, loc, on = define_sorts()
-    cities, packages, airplanes = decalre_consts(nc, np, na, C, P, A)
+    if strategy not in HORIZON_STRATEGIES:
+        raise ValueError('Unknown horizon strategy {}'.format(strategy))
+    if encoding not in ENCODINGS:
+        raise ValueError('Unknown encoding {}'.format(encoding))
+    cities, packages, airplanes, at, on, plane_at, moved = ENCODINGS[encoding](nc, np, na)
     
-    t_finish = 0
     # the maximum number of steps is 4 per package - airplane arrives, airplane loads, aiplane flies, airplane unloads
     t_limit = np * 4 
-    model = None
-    
-    while model is None and t_finish <= t_limit:
-        opt = Optimize() # this is used to minimize airplane moves, for the bonus question
-        airplane_moves = []
-        
-        basic_start_end_conditions(packages, cities, airplanes, at, on, loc, src, dst, start, t_finish, opt)
-        #add condition for plane to be at one city
-        for a in airplanes:
-            for t in range(t_finish + 1):
-                vars_for_in_cities = [loc(a,t) == c for c in cities]
-                opt.add(PbEq([(v, 1) for v in vars_for_in_cities], 1))
-                if t > 0:
-                    #for optimization:
-                    airplane_moves.append(If(loc(a, t) == loc(a, t - 1), 0, 1))# the plane adds a move if it moved
-                
-        #add conditions for packages 
-        for p in packages:
-            for t in range(t_finish + 1):
-                add_package_constraints(opt, p, t, cities, airplanes, at, on, loc)
-            
-            
-        if t_finish > 0:
-            opt.minimize(Sum(airplane_moves)) 
+    t_start = min(lower_bound, t_limit)
+    if bounds:
+        lower, upper = transport_bounds(nc, np, na, src, dst, start)
+        stats['lower_bound'], stats['upper_bound'] = lower, upper
+        t_limit = min(t_limit, upper)
+        # the start is clamped to the new limit again, a lower_bound above the upper bound still leaves it
+        # one horizon to probe
+        bounded_start = min(max(t_start, lower), t_limit)
+        # the horizons below the lower bound that the linear strategy doesn't probe. The upper bound saves no
+        # calls of the linear strategy, that stops at the first horizon with a plan
+        stats['horizons_skipped'] = max(bounded_start - t_start, 0)
+        t_start = bounded_start
+    deadline = None if timeout is None else time.perf_counter() + timeout
+    stats['strategy'] = strategy
+    stats['solver_calls'] = 0
+    stats['optimization_calls'] = 0
+
+    # one solver is kept alive for all horizons: every probe only adds the constraints of the
+    # time steps it has not seen yet, and the goal of each horizon is enabled through its own assumption literal
+    if two_phase:
+        s = SolverFor(logic) if logic else Solver() # the moves are only minimized after the horizon is known
+    else:
+        s = Optimize() # this is used to minimize airplane moves, for the bonus question
+    basic_start_conditions(packages, cities, airplanes, at, on, plane_at, src, start, s)
+    airplane_moves = [] # moves of every encoded time step
+    symmetry = new_symmetry_breaking(src, dst, start) if symmetry_breaking else None
+    stats['symmetry_classes'] = len(symmetry[0]) + len(symmetry[1]) if symmetry_breaking else 0
+    goals = dict()
+
+    def check_horizon(t_finish):
+        moves = encode_up_to(s, airplane_moves, t_finish, packages, cities, airplanes, at, on, plane_at, moved, symmetry)
+        if t_finish not in goals:
+            goals[t_finish] = add_goal(packages, cities, at, dst, t_finish, s)
+
+        s.push() # the objective belongs to this horizon only
+        if moves and not two_phase:
+            s.minimize(Sum(moves)) 
             # we are minimizing within the constraints of t_finish, so the time will still remain optimized
         
-        res = opt.check()
+        stats['solver_calls'] += 1
+        res = check_in_time(s, deadline, stats, goals[t_finish])
+        model = None
         if res == sat:
             print("SAT\n", t_finish)
-            model = opt.model()
-        elif res == unknown:
-            raise Exception('Got unknown from Z3')
-        else:
-            assert res == unsat
-            t_finish += 1
+            model = s.model()
+        s.pop()
+        return model
+
+    phase_start = time.perf_counter()
+    t_finish, model = HORIZON_STRATEGIES[strategy](check_horizon, t_start, t_limit)
+    stats['time_feasibility'] = time.perf_counter() - phase_start
 
-    # the loop has finished ma=eaning that either we reached the time limit (not suuposed to happen) or found a model
+    # the search has finished meaning that either we reached the time limit (not suuposed to happen) or found a model
     if model is None:
         print("Time limit reached")
+        stats['status'] = 'unsat'
         return None
-    else:
-        return extract_plan_from_model(model, cities, packages, airplanes, t_finish, at, on, loc)
+
+    phase_start = time.perf_counter()
+    if two_phase and tighten_moves:
+        moves = encode_up_to(s, airplane_moves, t_finish, packages, cities, airplanes, at, on, plane_at, moved, symmetry)
+        model = tighten_moves_at_horizon(s, model, moves, goals[t_finish], deadline, stats)
+    elif two_phase:
+        model = optimize_moves_at_horizon(t_finish, packages, cities, airplanes, at, on, plane_at, moved,
+                                          src, dst, start, symmetry_breaking, deadline, stats)
+    stats['time_optimization'] = time.perf_counter() - phase_start
+    stats['t_finish'] = t_finish
+    stats['status'] = 'sat'
+    return extract_plan_from_model(model, cities, packages, airplanes, t_finish, at, on, plane_at, encoding)
+
+def solve_problem(problem, timeout, options):
+    #solves one problem of solve_many, in a worker process
+    stats = dict()
+    start_time = time.perf_counter()
+    plan = None
+    try:
+        with contextlib.redirect_stdout(io.StringIO()): # the outputs of the workers would mix
+            plan = get_transport_plan(**problem, **options, timeout=timeout, stats=stats)
+        status = stats['status']
+    except Exception as e:
+        if stats.get('status') != 'unknown':
+            status = 'error: {}'.format(e)
+        elif timeout is not None and time.perf_counter() - start_time >= timeout:
+            status = 'timeout'
+        else:
+            status = 'unknown'
+    return dict(plan=plan, status=status, time=time.perf_counter() - start_time, stats=stats)
+
+
+def terminate_workers(processes):
+    #a running future can't be cancelled, so the processes of the pool are killed
+    for p in processes:
+        if p.is_alive():
+            p.terminate()
+        p.join()
+
+
+def solve_many(problems, workers=None, timeout=None, **options):
+    """
+    Solves many problems (dicts with nc, np, na, src, dst and start) with a pool of worker processes,
+    each of them with its own Z3 context. options are passed to get_transport_plan, and timeout is
+    the time in seconds for each problem. Z3 gets the timeout too, and a problem that a worker has
+    had for longer than timeout (and a grace second, for the encoding) is given up with the status
+    'timeout', so it doesn't hold back the rest of the batch.
+    This is a generator that yields (index, result) as soon as each problem is done, where result
+    is a dict with the plan, the status ('sat', 'unsat', 'timeout', ...), the time and the stats.
+    When the generator is closed early, the problems that didn't start are cancelled and the workers are killed.
+    """
+    context = multiprocessing.get_context('spawn')
+    pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=context)
+    futures = {pool.submit(solve_problem, problem, timeout, options): i for i, problem in enumerate(problems)}
+    pending = set(futures)
+    started = dict() # the time each future was first seen running
+    try:
+        while pending:
+            done, pending = concurrent.futures.wait(pending, timeout=None if timeout is None else 0.1,
+                                                    return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                yield futures[future], future.result()
+            if timeout is None:
+                continue
+            now = time.perf_counter()
+            for future in list(pending):
+                if future.running():
+                    started.setdefault(future, now)
+                if future in started and now - started[future] > timeout + 1:
+                    # the worker stays busy with it, and is killed when the batch is over
+                    pending.remove(future)
+                    yield futures[future], dict(plan=None, status='timeout', time=now - started[future], stats=dict())
+    finally:
+        abandoned = any(not future.done() for future in futures)
+        # shutdown forgets the processes of the pool, so they are taken before it
+        processes = list((pool._processes or {}).values())
+        pool.shutdown(wait=not abandoned, cancel_futures=True)
+        if abandoned:
+            terminate_workers(processes)
+
+
+# the configurations that race in get_transport_plan_portfolio, all of them find plans with the minimal
+# horizon and the minimal number of moves
+PLANNING_PORTFOLIO = [
+    dict(),
+    dict(encoding='bool'),
+    dict(encoding='bool', two_phase=True, tighten_moves=True),
+    dict(encoding='bool', two_phase=True, tighten_moves=True, logic='QF_FD'),
+    dict(encoding='bool', two_phase=True, tighten_moves=True, strategy='exponential', seed=1),
+    dict(encoding='uf', two_phase=True, tighten_moves=True, seed=2),
+]
+
+
+def get_transport_plan_portfolio(nc, np, na, src, dst, start, configurations=PLANNING_PORTFOLIO, timeout=None):
+    #races the configurations of get_transport_plan, and returns the plan of the first one to finish
+    plan, winner, stats = run_portfolio(get_transport_plan, (nc, np, na, src, dst, start), configurations, timeout)
+    if winner is None:
+        print("No configuration finished")
+        return None
+    print("Configuration {} won: {}".format(winner, configurations[winner]))
+    return plan
+
 
 #tests:
 def test_trivial():
@@ -332,6 +829,153 @@ def test_minimal_moves():
     city_packages, city_airplanes, airplane_packages = get_transport_plan(**example_problem)
     print_plan(city_packages, city_airplanes, airplane_packages)
 
+def test_horizon_strategies():
+    """
+    compare the number of solver calls of the horizon search strategies on the example problem,
+    without the bounds of transport_bounds (see test_bounds), so only lower_bound limits the search
+    """
+    print("\n=== Horizon strategies ===")
+    for strategy in HORIZON_STRATEGIES:
+        for lower_bound in [0, 3]:
+            stats = {}
+            get_transport_plan(**example_problem, strategy=strategy, lower_bound=lower_bound, bounds=False,
+                               stats=stats)
+            print("strategy {}, lower bound {}: horizon {} found with {} solver calls".format(
+                strategy, lower_bound, stats['t_finish'], stats['solver_calls']))
+
+
+def test_two_phase():
+    """
+    compare the time of the feasibility and the optimization phases in the different modes
+    """
+    print("\n=== Two phase ===")
+    for two_phase, tighten_moves in [(False, False), (True, False), (True, True)]:
+        stats = {}
+        get_transport_plan(**example_problem, two_phase=two_phase, tighten_moves=tighten_moves, stats=stats)
+        print("two_phase={}, tighten_moves={}: feasibility {:.3f}s ({} calls), optimization {:.3f}s ({} calls)".format(
+            two_phase, tighten_moves, stats['time_feasibility'], stats['solver_calls'],
+            stats['time_optimization'], stats['optimization_calls']))
+
+
+def test_encodings():
+    """
+    solve the example problem with every encoding, and compare the running times
+    """
+    print("\n=== Encodings ===")
+    for encoding in ENCODINGS:
+        start_time = time.perf_counter()
+        city_packages, city_airplanes, airplane_packages = get_transport_plan(**example_problem, encoding=encoding)
+        print("encoding {}: {:.3f}s".format(encoding, time.perf_counter() - start_time))
+        print_plan(city_packages, city_airplanes, airplane_packages)
+
+
+def benchmark_extraction(nc=8, np=12, na=3, t_finish=12, seed=0):
+    """
+    compare the bulk plan extraction to the evaluation of every cell, on a model of a random problem
+    """
+    rng = random.Random(seed)
+    src = [rng.randrange(nc) for i in range(np)]
+    dst = [rng.randrange(nc) for i in range(np)]
+    start = [rng.randrange(nc) for i in range(na)]
+    print("\n=== Extraction benchmark ({} cities, {} packages, {} airplanes, horizon {}) ===".format(nc, np, na, t_finish))
+    for encoding in ENCODINGS:
+        cities, packages, airplanes, at, on, plane_at, moved = ENCODINGS[encoding](nc, np, na)
+        s = Solver()
+        basic_start_conditions(packages, cities, airplanes, at, on, plane_at, src, start, s)
+        encode_up_to(s, [], t_finish, packages, cities, airplanes, at, on, plane_at, moved)
+        if s.check(add_goal(packages, cities, at, dst, t_finish, s)) != sat:
+            print("no plan with horizon", t_finish)
+            return
+        model = s.model()
+        times = dict()
+        plans = dict()
+        for mode in [None, encoding]:
+            start_time = time.perf_counter()
+            plans[mode] = extract_plan_from_model(model, cities, packages, airplanes, t_finish, at, on, plane_at, mode)
+            times[mode] = time.perf_counter() - start_time
+        assert plans[None] == plans[encoding]
+        print("encoding {}: per cell {:.4f}s, bulk {:.4f}s".format(encoding, times[None], times[encoding]))
+
+
+def test_symmetry_breaking():
+    """
+    the problem of test_minimal_moves with more packages, with and without symmetry breaking
+    """
+    example_problem = {
+        "nc": 2,
+        "np": 6,
+        "na": 4,
+        "src": [0, 0, 0, 0, 1, 1],
+        "dst": [1, 1, 1, 1, 0, 0],
+        "start": [0, 0, 0, 0],
+    }
+
+    print("\n=== Symmetry breaking ===")
+    for symmetry_breaking in [False, True]:
+        stats = {}
+        start_time = time.perf_counter()
+        get_transport_plan(**example_problem, symmetry_breaking=symmetry_breaking, stats=stats)
+        print("symmetry_breaking={}: {} symmetry classes, {:.3f}s".format(
+            symmetry_breaking, stats['symmetry_classes'], time.perf_counter() - start_time))
+
+
+def test_solve_many():
+    """
+    solve a batch of random problems with a pool of processes
+    """
+    rng = random.Random(0)
+    problems = []
+    for i in range(8):
+        nc, np, na = rng.randint(2, 5), rng.randint(1, 6), rng.randint(1, 3)
+        problems.append(dict(nc=nc, np=np, na=na,
+                             src=[rng.randrange(nc) for j in range(np)],
+                             dst=[rng.randrange(nc) for j in range(np)],
+                             start=[rng.randrange(nc) for j in range(na)]))
+
+    print("\n=== Solve many ===")
+    start_time = time.perf_counter()
+    for i, result in solve_many(problems, workers=4, timeout=60, encoding='bool'):
+        print("problem {}: {} in {:.3f}s, horizon {}".format(
+            i, result['status'], result['time'], result['stats'].get('t_finish')))
+    print("total {:.3f}s".format(time.perf_counter() - start_time))
+
+    # closing the generator while a long problem is running kills its worker
+    long_problem = dict(nc=8, np=14, na=2, src=[i % 8 for i in range(14)], dst=[(3 * i + 1) % 8 for i in range(14)],
+                        start=[0, 4])
+    start_time = time.perf_counter()
+    results = solve_many([problems[0], long_problem], workers=2, timeout=60, encoding='bool')
+    for i, result in results:
+        if i == 0:
+            break
+    results.close()
+    assert not multiprocessing.active_children()
+    print("closed after {:.3f}s".format(time.perf_counter() - start_time))
+
+
+def test_portfolio():
+    print("\n=== Portfolio ===")
+    print_problem(**example_problem)
+    plan = get_transport_plan_portfolio(**example_problem)
+    print_plan(*plan)
+
+
+def test_bounds():
+    """
+    compare the number of solver calls with and without the bounds of transport_bounds
+    """
+    print("\n=== Bounds ===")
+    print(transport_bounds(**example_problem))
+    for strategy in HORIZON_STRATEGIES:
+        for bounds in [False, True]:
+            stats = {}
+            get_transport_plan(**example_problem, strategy=strategy, bounds=bounds, stats=stats)
+            print("strategy {}, bounds={}: horizon {} found with {} solver calls, bounds {}".format(
+                strategy, bounds, stats['t_finish'], stats['solver_calls'],
+                (stats.get('lower_bound'), stats.get('upper_bound'))))
+    # a lower_bound above the upper bound of the problem still finds a plan
+    trivial_problem = dict(nc=1, np=1, na=1, src=[0], dst=[0], start=[0])
+    assert get_transport_plan(**trivial_problem, lower_bound=2) is not None
+
 
 if __name__ == '__main__':
 
@@ -347,3 +991,11 @@ if __name__ == '__main__':
     test_two_airplanes()
     test_sequential_moves()
     test_minimal_moves()
+    test_horizon_strategies()
+    test_two_phase()
+    test_encodings()
+    test_symmetry_breaking()
+    benchmark_extraction()
+    test_solve_many()
+    test_portfolio()
+    test_bounds()
@@ -0,0 +1,73 @@
+"""
+Portfolio solving: several configurations of the same solving function race on one instance.
+"""
+import contextlib
+import io
+import multiprocessing
+import queue
+import time
+
+from z3 import set_param
+
+# seconds between the checks that the processes of the portfolio are still alive
+POLL = 0.5
+
+
+def run_configuration(function, args, config, results, index):
+    #runs one configuration of the portfolio, in its own process (and so with its own Z3 context)
+    config = dict(config)
+    seed = config.pop('seed', None)
+    if seed is not None:
+        set_param('smt.random_seed', seed)
+        set_param('sat.random_seed', seed)
+    stats = dict()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()): # the outputs of the configurations would mix
+            result = function(*args, **config, stats=stats)
+        definitive = stats.get('status') in ('sat', 'unsat')
+    except Exception:
+        result, definitive = None, False
+    results.put((index, definitive, result, stats))
+
+
+def run_portfolio(function, args, configurations, timeout=None):
+    """
+    Runs function(*args, **config, stats=stats) for every config in configurations in parallel processes,
+    and returns the first definitive answer - a run that ended with stats['status'] 'sat' or 'unsat'.
+    A config may also have a 'seed', which sets the random seeds of Z3 in its process.
+    The other processes are killed as soon as there is an answer (or when the timeout, in seconds, runs out).
+    A process that dies without an answer counts as a configuration that didn't give a definitive one.
+    Returns (result, winner, stats), where winner is the index of the configuration that answered,
+    or (None, None, None) if no configuration gave a definitive answer.
+    """
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    processes = [context.Process(target=run_configuration, args=(function, args, config, results, i), daemon=True)
+                 for i, config in enumerate(configurations)]
+    deadline = None if timeout is None else time.perf_counter() + timeout
+    for p in processes:
+        p.start()
+    try:
+        answers = 0
+        while answers < len(processes):
+            remaining = None if deadline is None else deadline - time.perf_counter()
+            if remaining is not None and remaining <= 0:
+                break # the timeout ran out
+            try:
+                # polled, so a process that died without an answer (a crash of Z3, killed for memory) is noticed
+                index, definitive, result, stats = results.get(timeout=POLL if remaining is None else min(POLL, remaining))
+            except queue.Empty:
+                # a dead process counts as an answer that is not definitive. Its answer may still be in the queue
+                # (a process can exit before its answer is read), so the queue is checked once more before giving up
+                if all(not p.is_alive() for p in processes) and results.empty():
+                    break
+                continue
+            answers += 1
+            if definitive:
+                return result, index, stats
+    finally:
+        for p in processes:
+            if p.is_alive():
+                p.terminate()
+            p.join()
+    return None, None, None